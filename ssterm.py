@@ -28,9 +28,25 @@ import sys
 import os
 import re
 import select
+import signal
+import socket
+import stat
+import errno
 import getopt
+import array
+import collections
 import string
 import termios
+import fcntl
+import struct
+import threading
+import time
+import math
+
+try:
+    import asyncio
+except ImportError:
+    asyncio = None
 
 ###############################################################################
 ### Default Options
@@ -42,17 +58,39 @@ TTY_Options = {
     'databits': 8,
     'stopbits': 1,
     'parity': "none",
-    'flow_control': "none"
+    'flow_control': "none",
+    'low_latency': False,
 }
 
 # Default Formatting Options
 Format_Options = {
-    'output_mode': 'raw',       # 'split', 'splitfull', 'hex', 'hexnl'
+    'output_mode': 'raw',       # 'split', 'splitfull', 'hex', 'hexnl', 'histogram'
     'input_mode': 'raw',        # 'hex'
     'transmit_newline': "raw",  # 'cr', 'crlf', 'lf', 'none'
     'receive_newline': "raw",   # 'cr', 'crlf', 'lf', 'crorlf'
     'echo': False,
+    'tx_char_delay': 0,         # milliseconds
+    'tx_line_delay': 0,         # milliseconds
+    'tx_echo_wait': False,
+    'tx_pace_auto': False,
     'color_chars': b'',         # e.g. b"\nA"
+    'timestamp': 'none',        # 'wall', 'mono', 'delta'
+    'modem_lines': False,
+    'rx_include': None,         # e.g. "^(WARN|ERR)"
+    'rx_exclude': None,         # e.g. "DEBUG"
+    'rx_filter_prefix': False,  # interpret filters as comma-delimited prefixes
+    'max_latency': 0,           # milliseconds, 0 to disable
+    'scrollback_size': 1048576, # bytes, 0 to disable
+    'capture_path': None,       # e.g. "capture.bin"
+    'histogram_dump': None,     # e.g. "histogram.csv"
+}
+
+# Default Server Options
+Server_Options = {
+    'address': None,            # e.g. "tcp::5000", "unix:/tmp/ssterm.sock"
+    'write_lock': 'first',      # 'last', 'none'
+    'queue_size': 65536,        # bytes
+    'slow_client': 'drop',      # 'lag'
 }
 
 ###############################################################################
@@ -62,6 +100,9 @@ Format_Options = {
 # Quit Escape Character: Ctrl-] = 0x1D
 Quit_Escape_Character = 0x1d if sys.version_info[0] >= 3 else "\x1d"
 
+# Command Escape Character: Ctrl-T = 0x14
+Command_Escape_Character = b"\x14"
+
 # Number of columns in hexadecimal print mode
 Hexadecimal_Columns = 16
 
@@ -77,21 +118,157 @@ Color_Code_Reset = b"\x1b[0m"
 # Read buffer size
 READ_BUF_SIZE = 4096
 
+# Maximum size of a single write to stdout
+WRITE_BUF_SIZE = 4096
+
+# Maximum amount of formatted output pending for stdout before we stop reading
+# the serial port, when the display latency budget is disabled
+Output_Queue_Max = 262144
+
+# Maximum amount of received data held back from display, e.g. while a prompt
+# is open, before it is skipped
+Held_Queue_Max = 262144
+
+# Default buffer limit of the asyncio serial terminal reader, which stops
+# reading the serial port at twice the limit until the buffer is consumed
+Reader_Limit = 65536
+
+# Serial driver ioctls and flags missing in termios module on some versions
+TIOCGSERIAL = getattr(termios, 'TIOCGSERIAL', 0x541E)
+TIOCSSERIAL = getattr(termios, 'TIOCSSERIAL', 0x541F)
+TIOCGICOUNT = getattr(termios, 'TIOCGICOUNT', 0x545D)
+ASYNC_LOW_LATENCY = 1 << 13
+
+# Transmit echo timeout in seconds, and number of unexpected received bytes
+# tolerated before an echo is considered lost
+TX_Echo_Timeout = 1.0
+TX_Echo_Slack = 16
+
+# Adaptive transmit pacing maximum window in bytes, minimum inter-byte delay
+# in seconds, and minimum echo timeout in seconds, which is otherwise a
+# multiple of the measured echo round trip time
+TX_Adaptive_Max_Window = 64
+TX_Adaptive_Min_Delay = 0.001
+TX_Adaptive_Min_Timeout = 0.05
+
+# Ping probe timeout and interval in seconds
+Ping_Timeout = 1.0
+Ping_Interval = 0.01
+
+# Monotonic clock (Python 3.3+), falling back to wall-clock time
+clock_monotonic = getattr(time, 'monotonic', time.time)
+
+# Termios baudrates
+Termios_Baudrates = {
+    50: termios.B50, 75: termios.B75, 110: termios.B110, 134: termios.B134,
+    150: termios.B150, 200: termios.B200, 300: termios.B300,
+    600: termios.B600, 1200: termios.B1200, 1800: termios.B1800,
+    2400: termios.B2400, 4800: termios.B4800, 9600: termios.B9600,
+    19200: termios.B19200, 38400: termios.B38400, 57600: termios.B57600,
+    115200: termios.B115200, 230400: termios.B230400,
+    # Linux baudrates bits missing in termios module included below
+    460800: 0x1004, 500000: 0x1005, 576000: 0x1006,
+    921600: 0x1007, 1000000: 0x1008, 1152000: 0x1009,
+
+    1500000: 0x100A, 2000000: 0x100B, 2500000: 0x100C,
+    3000000: 0x100D, 3500000: 0x100E, 4000000: 0x100F,
+}
+
+# Modem lines and their names
+Modem_Lines = [("CTS", termios.TIOCM_CTS), ("DSR", termios.TIOCM_DSR),
+               ("DCD", termios.TIOCM_CD), ("RI", termios.TIOCM_RI),
+               ("DTR", termios.TIOCM_DTR), ("RTS", termios.TIOCM_RTS)]
+
+# Modem input lines and their transition counter index in the TIOCGICOUNT
+# serial_icounter_struct (cts, dsr, rng, dcd, ...)
+Modem_Line_Counters = [("CTS", termios.TIOCM_CTS, 0), ("DSR", termios.TIOCM_DSR, 1),
+                       ("RI", termios.TIOCM_RI, 2), ("DCD", termios.TIOCM_CD, 3)]
+
+# Characters considered valid when scoring baudrates
+Baudrate_Printable_Characters = (string.ascii_letters + string.digits + string.punctuation + " \t\r\n").encode()
+
+# Time to sample received data at each baudrate during detection, in seconds
+Baudrate_Detect_Window = 0.1
+
 # Newline Substitution tables
 RX_Newline_Sub = {'raw': None, 'cr': b"\r", 'crlf': b"\r\n", 'lf': b"\n", 'crorlf': b"\r|\n"}
 TX_Newline_Sub = {'raw': None, 'cr': b"\r", 'crlf': b"\r\n", 'lf': b"\n", 'none': b""}
 
+# Output modes
+Output_Modes = ['raw', 'split', 'splitfull', 'hex', 'hexnl', 'histogram']
+
+# Number of most recent matches displayed by a scrollback search, and bytes of
+# context displayed around each match, up to a maximum per match
+Scrollback_Search_Results = 8
+Scrollback_Render_Context = 4*Hexadecimal_Columns
+Scrollback_Render_Max = 16*Hexadecimal_Columns
+
+# Maximum length of a partial line held back by the line filter
+Filter_Max_Line_Length = 65536
+
+# Histogram output mode refresh interval in seconds, number of power of two
+# bins for chunk sizes and gaps, number of most frequent byte values
+# displayed, bar width, and chunk size above which byte values are counted
+# with collections.Counter
+Histogram_Refresh_Interval = 0.5
+Histogram_Bins = 32
+Histogram_Top_Values = 16
+Histogram_Bar_Width = 40
+Histogram_Counter_Threshold = 64
+
+# Line timestamp modes
+Timestamp_Modes = ['none', 'wall', 'mono', 'delta']
+
+# Options that can be reconfigured during a session, by name, with their
+# options key and valid values
+Reconfigure_Options = {
+    'baudrate': ('baudrate', int),
+    'databits': ('databits', [5, 6, 7, 8]),
+    'parity': ('parity', ["none", "odd", "even"]),
+    'stopbits': ('stopbits', [1, 2]),
+    'flow': ('flow_control', ["none", "rtscts", "xonxoff"]),
+    'output': ('output_mode', Output_Modes),
+    'rx-nl': ('receive_newline', sorted(RX_Newline_Sub)),
+    'timestamp': ('timestamp', Timestamp_Modes),
+    'input': ('input_mode', ["raw", "hex"]),
+    'tx-nl': ('transmit_newline', sorted(TX_Newline_Sub)),
+}
+
 ###############################################################################
 ### Serial Helper Functions
 ###############################################################################
 
-def serial_open(device_path, baudrate, databits, stopbits, parity, flow_control):
+def termios_baudrate_set(tty_attr, baudrate):
+    # Clear any existing baudrate bits -- tty_attr[cflag]
+    tty_attr[2] &= ~termios.CBAUD
+
+    # Look up the termios baudrate and set it in the attributes structure
+    #   tty_attr[cflag], tty_attr[ispeed], tty_attr[ospeed]
+    if baudrate in Termios_Baudrates:
+        tty_attr[2] |= Termios_Baudrates[baudrate]
+        tty_attr[4] = Termios_Baudrates[baudrate]
+        tty_attr[5] = Termios_Baudrates[baudrate]
+    else:
+        # Set alternate speed via BOTHER (=0x1000) cflag,
+        # Pass baudrate directly in ispeed, ospeed
+        tty_attr[2] |= 0x1000
+        tty_attr[4] = baudrate
+        tty_attr[5] = baudrate
+
+def serial_open(device_path, baudrate, databits, stopbits, parity, flow_control, low_latency=False):
     # Open the tty device
     try:
         fd = os.open(device_path, os.O_RDWR | os.O_NOCTTY)
     except OSError as err:
         raise Exception("%s" % str(err))
 
+    # Configure the tty device
+    serial_configure(fd, baudrate, databits, stopbits, parity, flow_control, low_latency)
+
+    # Return the fd
+    return fd
+
+def serial_configure(fd, baudrate, databits, stopbits, parity, flow_control, low_latency=False):
     # Get current termios attributes
     #   [iflag, oflag, cflag, lflag, ispeed, ospeed, cc]
     try:
@@ -107,32 +284,7 @@ def serial_open(device_path, baudrate, databits, stopbits, parity, flow_control)
     tty_attr[2] = (termios.CREAD | termios.CLOCAL)
 
     # Look up the termios baudrate and set it in the attributes structure
-    #   tty_attr[cflag], tty_attr[ispeed], tty_attr[ospeed]
-    termios_baudrates = {
-        50: termios.B50, 75: termios.B75, 110: termios.B110, 134: termios.B134,
-        150: termios.B150, 200: termios.B200, 300: termios.B300,
-        600: termios.B600, 1200: termios.B1200, 1800: termios.B1800,
-        2400: termios.B2400, 4800: termios.B4800, 9600: termios.B9600,
-        19200: termios.B19200, 38400: termios.B38400, 57600: termios.B57600,
-        115200: termios.B115200, 230400: termios.B230400,
-        # Linux baudrates bits missing in termios module included below
-        460800: 0x1004, 500000: 0x1005, 576000: 0x1006,
-        921600: 0x1007, 1000000: 0x1008, 1152000: 0x1009,
-
-        1500000: 0x100A, 2000000: 0x100B, 2500000: 0x100C,
-        3000000: 0x100D, 3500000: 0x100E, 4000000: 0x100F,
-    }
-
-    if baudrate in termios_baudrates:
-        tty_attr[2] |= termios_baudrates[baudrate]
-        tty_attr[4] = termios_baudrates[baudrate]
-        tty_attr[5] = termios_baudrates[baudrate]
-    else:
-        # Set alternate speed via BOTHER (=0x1000) cflag,
-        # Pass baudrate directly in ispeed, ospeed
-        tty_attr[2] |= 0x1000
-        tty_attr[4] = baudrate
-        tty_attr[5] = baudrate
+    termios_baudrate_set(tty_attr, baudrate)
 
     # Look up and set the appropriate cflag bits in termios_options for a given
     # option
@@ -183,18 +335,294 @@ def serial_open(device_path, baudrate, databits, stopbits, parity, flow_control)
     if flow_control == "xonxoff":
         tty_attr[0] |= (termios.IXON | termios.IXOFF | termios.IXANY)
 
-    # Set new termios attributes
+    ######################################################################
+    ### cc
+    ######################################################################
+
+    # Return from reads as soon as one character is available, without an
+    # inter-character timer -- tty_attr[cc]
+    if low_latency:
+        tty_attr[6][termios.VMIN] = 1
+        tty_attr[6][termios.VTIME] = 0
+
+    # Set new termios attributes immediately, without discarding buffered
+    # data, so the port can be reconfigured while in use
     try:
         termios.tcsetattr(fd, termios.TCSANOW, tty_attr)
     except termios.error as err:
         raise Exception("Setting serial port options: %s" % str(err))
 
-    # Return the fd
-    return fd
+def serial_set_low_latency(fd):
+    # Get the serial_struct of the driver. The buffer is larger than the
+    # serial_struct, of which only the int flags field (5th) is used.
+    serial_struct = array.array('i', [0] * 32)
+    try:
+        fcntl.ioctl(fd, TIOCGSERIAL, serial_struct, True)
+    except IOError as err:
+        raise Exception("Getting serial driver options: %s" % str(err))
+
+    # Set the low latency flag
+    serial_struct[4] |= ASYNC_LOW_LATENCY
+    try:
+        fcntl.ioctl(fd, TIOCSSERIAL, serial_struct)
+    except IOError as err:
+        raise Exception("Setting serial driver low latency: %s" % str(err))
+
+def serial_set_baudrate(fd, baudrate):
+    try:
+        tty_attr = termios.tcgetattr(fd)
+        termios_baudrate_set(tty_attr, baudrate)
+        termios.tcsetattr(fd, termios.TCSANOW, tty_attr)
+    except termios.error as err:
+        raise Exception("Setting serial port baudrate: %s" % str(err))
+
+def baudrate_score(buf):
+    # Count and remove parity and framing error marks (0xff 0x00), after
+    # replacing escaped 0xff bytes (0xff 0xff) with a non-printable byte
+    buf = buf.replace(b"\xff\xff", b"\xfe")
+    errors = buf.count(b"\xff\x00")
+    buf = buf.replace(b"\xff\x00", b"")
+
+    if len(buf) == 0:
+        return -errors
+
+    # Fraction of printable characters, less the fraction of errors
+    printable = len(buf) - len(buf.translate(None, Baudrate_Printable_Characters))
+    score = float(printable - 2*errors) / len(buf)
+
+    # Bonus for newlines at a plausible line length
+    newlines = buf.count(b"\n")
+    if newlines > 0 and len(buf) / newlines <= 256:
+        score += 0.1
+
+    return score
+
+def serial_detect_baudrate(fd, baudrates, window):
+    # Mark parity and framing errors in received data -- tty_attr[iflag]
+    try:
+        tty_attr = termios.tcgetattr(fd)
+        iflag = tty_attr[0]
+        tty_attr[0] = (iflag | termios.INPCK | termios.PARMRK) & ~(termios.ISTRIP | termios.IGNPAR)
+        termios.tcsetattr(fd, termios.TCSANOW, tty_attr)
+    except termios.error as err:
+        raise Exception("Setting serial port options: %s" % str(err))
+
+    best = None
+
+    try:
+        for baudrate in baudrates:
+            # Switch baudrate and discard data received at the previous one
+            serial_set_baudrate(fd, baudrate)
+            termios.tcflush(fd, termios.TCIFLUSH)
+
+            # Sample received data for the window
+            buf = b""
+            deadline = clock_monotonic() + window
+            while True:
+                timeout = deadline - clock_monotonic()
+                if timeout <= 0:
+                    break
+
+                ready_read_fds, _, _ = select.select([fd], [], [], timeout)
+                if fd in ready_read_fds:
+                    try:
+                        data = os.read(fd, READ_BUF_SIZE)
+                    except Exception as err:
+                        raise Exception("Error reading serial port: %s" % str(err))
+                    if len(data) == 0:
+                        raise Exception("Serial port closed")
+                    buf += data
+
+            if len(buf) == 0:
+                continue
+
+            # Keep the best scoring baudrate, preferring more data on ties
+            score = (baudrate_score(buf), len(buf))
+            if best is None or score > best[0]:
+                best = (score, baudrate)
+    finally:
+        # Restore iflag
+        tty_attr = termios.tcgetattr(fd)
+        tty_attr[0] = iflag
+        termios.tcsetattr(fd, termios.TCSANOW, tty_attr)
+
+    if best is None:
+        raise Exception("No data received at any baudrate")
+
+    # Lock onto the best baudrate
+    serial_set_baudrate(fd, best[1])
+    termios.tcflush(fd, termios.TCIFLUSH)
+
+    return best[1]
+
+def serial_modem_lines_get(fd):
+    try:
+        buf = fcntl.ioctl(fd, termios.TIOCMGET, struct.pack('I', 0))
+    except IOError as err:
+        raise Exception("Getting modem lines: %s" % str(err))
+
+    return struct.unpack('I', buf)[0]
+
+def serial_modem_lines_toggle(fd, lines):
+    # Clear the lines if they're set, otherwise set them
+    state = serial_modem_lines_get(fd)
+    try:
+        fcntl.ioctl(fd, termios.TIOCMBIC if state & lines else termios.TIOCMBIS, struct.pack('I', lines))
+    except IOError as err:
+        raise Exception("Setting modem lines: %s" % str(err))
+
+    return not (state & lines)
+
+def serial_modem_lines_counts(fd):
+    # Get the modem input line transition counters of serial_icounter_struct,
+    # or None if the driver doesn't support them
+    try:
+        buf = fcntl.ioctl(fd, TIOCGICOUNT, struct.pack('20i', *([0]*20)))
+    except IOError:
+        return None
+
+    return struct.unpack('20i', buf)[0:4]
+
+def serial_modem_lines_pulses(old, new, old_counts, new_counts):
+    # Lines that made more transitions than their net change of state, i.e.
+    # pulsed before we got the state
+    if old_counts is None or new_counts is None:
+        return None
+
+    pulses = []
+    for name, line, i in Modem_Line_Counters:
+        if new_counts[i] - old_counts[i] > (1 if (old ^ new) & line else 0):
+            pulses.append(name)
+
+    return pulses
+
+def serial_modem_lines_monitor(fd, event_fd):
+    # Thread that waits in the kernel for modem input line changes with
+    # TIOCMIWAIT, and writes a formatted event for each to event_fd
+    mask = termios.TIOCM_CTS | termios.TIOCM_DSR | termios.TIOCM_CD | termios.TIOCM_RI
+
+    try:
+        state = serial_modem_lines_get(fd)
+        counts = serial_modem_lines_counts(fd)
+        os.write(event_fd, modem_lines_format(time.time(), None, state).encode() + b"\n")
+
+        while True:
+            fcntl.ioctl(fd, termios.TIOCMIWAIT, mask)
+            t = time.time()
+            new_state = serial_modem_lines_get(fd)
+            new_counts = serial_modem_lines_counts(fd)
+            pulses = serial_modem_lines_pulses(state, new_state, counts, new_counts)
+            os.write(event_fd, modem_lines_format(t, state, new_state, pulses).encode() + b"\n")
+            state, counts = new_state, new_counts
+    except Exception as err:
+        try:
+            os.write(event_fd, ("[modem %s monitoring stopped: %s]\n" % (format_time(time.time()), str(err))).encode())
+        except OSError:
+            pass
+
+def modem_lines_format(t, old, new, pulses=None):
+    # Format modem line state, marking lines that were raised with + and lines
+    # that were lowered with -, followed by lines that pulsed
+    lines = []
+    for name, line in Modem_Lines:
+        if old is not None and (old ^ new) & line:
+            lines.append(("+" if new & line else "-") + name)
+        else:
+            lines.append("%s=%d" % (name, 1 if new & line else 0))
+
+    for name in (pulses or []):
+        lines.append("%s pulse" % name)
+
+    # Lines can change and change back before we get the state, and without
+    # transition counters we can't tell which
+    if old is not None and old == new and not pulses:
+        lines.append("transient change")
+
+    return "[modem %s %s]" % (format_time(t), " ".join(lines))
 
 def serial_close(fd):
     os.close(fd)
 
+###############################################################################
+### Socket Helper Functions
+###############################################################################
+
+def socket_address_parse(address, host=""):
+    # Unix socket address: unix:<path>
+    if address.startswith("unix:"):
+        return socket.AF_UNIX, address[5:]
+
+    # TCP socket address: tcp:[host]:<port>
+    if address.startswith("tcp:"):
+        host_port = address[4:].rsplit(":", 1)
+        if len(host_port) != 2:
+            raise ValueError("Invalid TCP address \"%s\", expected tcp:[host]:<port>" % address)
+
+        try:
+            port = int(host_port[1], 10)
+        except ValueError:
+            raise ValueError("Invalid TCP port \"%s\"" % host_port[1])
+
+        # Strip brackets from IPv6 hosts
+        if len(host_port[0]) > 0:
+            host = host_port[0].strip("[]")
+
+        return (socket.AF_INET6 if ":" in host else socket.AF_INET), (host, port)
+
+    # Not a socket address
+    return None
+
+def socket_open(address):
+    family, sockaddr = socket_address_parse(address, "localhost")
+
+    # Connect to the server
+    try:
+        if family == socket.AF_UNIX:
+            sock = socket.socket(family, socket.SOCK_STREAM)
+            sock.connect(sockaddr)
+        else:
+            sock = socket.create_connection(sockaddr)
+    except socket.error as err:
+        raise Exception("%s" % str(err))
+
+    # Return a duplicate of the fd that is independent of the socket object
+    fd = os.dup(sock.fileno())
+    sock.close()
+
+    return fd
+
+def socket_listen(address):
+    family, sockaddr = socket_address_parse(address)
+
+    try:
+        # Remove a unix socket left behind by a server that didn't exit
+        # cleanly, but not any other kind of file
+        if family == socket.AF_UNIX:
+            try:
+                if stat.S_ISSOCK(os.stat(sockaddr).st_mode):
+                    os.unlink(sockaddr)
+            except OSError as err:
+                if err.errno != errno.ENOENT:
+                    raise
+
+        sock = socket.socket(family, socket.SOCK_STREAM)
+        if family != socket.AF_UNIX:
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        sock.bind(sockaddr)
+        sock.listen(16)
+    except (socket.error, OSError) as err:
+        raise Exception("%s" % str(err))
+
+    sock.setblocking(False)
+
+    return sock
+
+def socket_close(sock):
+    # Remove the unix socket path we created
+    if sock.family == socket.AF_UNIX:
+        os.unlink(sock.getsockname())
+    sock.close()
+
 ###############################################################################
 ### TTY Helper Functions
 ###############################################################################
@@ -339,6 +767,78 @@ def output_processor_newline(sub):
             buf = buf[:-1]
 
         return buf
+
+    # Release the left-over newline character match
+    def flush():
+        buf, state[0] = state[0], b""
+        return buf
+
+    f.flush = flush
+    return f
+
+def output_processor_filter(include=None, exclude=None, stats=None):
+    # Convert constants to byte strings
+    linesep = os.linesep.encode()
+
+    # Build a line matching function from a compiled regular expression or a
+    # tuple of literal prefixes
+    def matcher(pattern):
+        if isinstance(pattern, tuple):
+            return lambda line: line.startswith(pattern)
+        return lambda line: pattern.search(line) is not None
+
+    include_match = matcher(include) if include is not None else None
+    exclude_match = matcher(exclude) if exclude is not None else None
+
+    def keep(line):
+        if include_match is not None and not include_match(line):
+            return False
+        if exclude_match is not None and exclude_match(line):
+            return False
+        return True
+
+    # State to keep track of the current partial line
+    state = [b""]
+
+    # Drop lines in buf that don't match the include filter or that match the
+    # exclude filter
+    def f(buf):
+        buf = state[0] + buf
+
+        lines = buf.split(linesep)
+        partial = lines.pop()
+
+        kept = [line + linesep for line in lines if keep(line)]
+
+        # Filter an overlong partial line without waiting for its newline
+        if len(partial) >= Filter_Max_Line_Length:
+            lines.append(partial)
+            if keep(partial):
+                kept.append(partial)
+            partial = b""
+
+        state[0] = partial
+        nbuf = b"".join(kept)
+
+        if stats is not None:
+            stats['filtered_lines'] += len(lines) - len(kept)
+            stats['filtered_bytes'] += (len(buf) - len(state[0])) - len(nbuf)
+
+        return nbuf
+
+    # Filter the partial line without waiting for its newline
+    def flush():
+        line, state[0] = state[0], b""
+        if len(line) == 0 or keep(line):
+            return line
+
+        if stats is not None:
+            stats['filtered_lines'] += 1
+            stats['filtered_bytes'] += len(line)
+
+        return b""
+
+    f.flush = flush
     return f
 
 def output_processor_raw(color_chars=b''):
@@ -367,6 +867,60 @@ def output_processor_raw(color_chars=b''):
             return nbuf
         return f
 
+def output_processor_timestamp(mode):
+    # Convert constants to byte strings
+    linesep = os.linesep.encode()
+
+    # State to keep track of whether we're at the start of a line, and the
+    # time of the last timestamp
+    start = clock_monotonic()
+    state = [True, start]
+
+    # Prefix every line in buf with a timestamp. The clock is read once per
+    # buffer, so all lines within a buffer share the same time.
+    def f(buf):
+        if len(buf) == 0:
+            return b""
+
+        # Format the timestamps for this buffer
+        if mode == 'wall':
+            first = ("[%s] " % format_time(time.time())).encode()
+            rest = first
+        elif mode == 'mono':
+            first = ("[%.6f] " % (clock_monotonic() - start)).encode()
+            rest = first
+        else:
+            t = clock_monotonic()
+            first = ("[+%.6f] " % (t - state[1])).encode()
+            rest = b"[+0.000000] "
+
+        parts = buf.split(linesep)
+
+        # A trailing newline leaves an empty part that belongs to the next
+        # line, which will be timestamped when its first character arrives
+        at_line_start = len(parts) > 1 and len(parts[-1]) == 0
+        if at_line_start:
+            parts.pop()
+
+        if state[0]:
+            nbuf = first + (linesep + rest).join(parts)
+        elif len(parts) > 1:
+            nbuf = parts[0] + linesep + first + (linesep + rest).join(parts[1:])
+        else:
+            nbuf = parts[0]
+
+        if at_line_start:
+            nbuf += linesep
+
+        # Keep track of the time of the last timestamp for delta mode
+        if mode == 'delta' and (state[0] or len(parts) > 1):
+            state[1] = t
+
+        state[0] = at_line_start
+
+        return nbuf
+    return f
+
 def output_processor_hexadecimal(color_chars=b'', interpret_newlines=False):
     # Convert constants to byte strings
     linesep = os.linesep.encode()
@@ -404,6 +958,15 @@ def output_processor_hexadecimal(color_chars=b'', interpret_newlines=False):
                 nbuf += linesep
                 state[0] = 0
         return nbuf
+
+    # End the current partial line
+    def flush():
+        if state[0] == 0:
+            return b""
+        state[0] = 0
+        return linesep
+
+    f.flush = flush
     return f
 
 def output_processor_split(color_chars=b'', partial_lines=True):
@@ -495,48 +1058,992 @@ def output_processor_split(color_chars=b'', partial_lines=True):
         # Remove processed full lines from our state
         state[0] = state[0][len(state[0])-(len(state[0]) % Hexadecimal_Columns):len(state[0])]
         return nbuf
+
+    # End the current partial line, formatting it if it hasn't been displayed
+    def flush():
+        line, state[0] = state[0], b""
+        if len(line) == 0:
+            return b""
+        elif partial_lines:
+            return linesep
+        return format_split_line(line) + linesep
+
+    f.flush = flush
+    return f
+
+def output_processor_histogram(histogram=None):
+    # Convert constants to byte strings
+    clear_screen = b"\x1b[2J\x1b[H"
+
+    if histogram is None:
+        histogram = Histogram()
+
+    # State to keep track of the time of the last refresh, and whether the
+    # counters have changed since
+    state = [None, False]
+
+    def render(t):
+        state[0], state[1] = t, False
+        return clear_screen + histogram.render().encode()
+
+    # Count buf into the histogram, to be displayed on the next refresh
+    def update(buf):
+        if len(buf) == 0:
+            return
+
+        histogram.update(buf, clock_monotonic())
+        state[1] = True
+
+    # Count buf into the histogram, and replace the data with a summary view
+    # of the counters, refreshed at most once per refresh interval
+    def f(buf):
+        update(buf)
+
+        t = clock_monotonic()
+        if not state[1] or (state[0] is not None and t - state[0] < Histogram_Refresh_Interval):
+            return b""
+
+        return render(t)
+
+    # Time of the next refresh of changed counters, or None
+    def refresh_time():
+        if not state[1]:
+            return None
+        return state[0] + Histogram_Refresh_Interval if state[0] is not None else 0.0
+
+    # Refresh the summary view of changed counters
+    def refresh(t):
+        return render(t)
+
+    # Display the final summary
+    def flush():
+        if histogram.chunks == 0:
+            return b""
+        return render(clock_monotonic())
+
+    f.flush = flush
+    f.update = update
+    f.refresh_time = refresh_time
+    f.refresh = refresh
+    f.histogram = histogram
     return f
 
 ###############################################################################
-### Main Read/Write Loop
+### Pipelines
 ###############################################################################
 
-def read_write_loop(serial_fd, stdin_fd, stdout_fd):
-    ### Prepare our input pipeline
+def input_pipeline_build(options):
     input_pipeline = []
     # Hexadecimal interpretation
-    if Format_Options['input_mode'] == "hex":
+    if options['input_mode'] == "hex":
         input_pipeline.append(input_processor_hexadecimal())
     # Transmit newline substitution
-    if TX_Newline_Sub[Format_Options['transmit_newline']] is not None:
-        input_pipeline.append(input_processor_newline(TX_Newline_Sub[Format_Options['transmit_newline']]))
+    if TX_Newline_Sub[options['transmit_newline']] is not None:
+        input_pipeline.append(input_processor_newline(TX_Newline_Sub[options['transmit_newline']]))
+
+    return input_pipeline
+
+def pipeline_flush(pipeline):
+    # Flush data held back by processors with a flush function, passing it
+    # through the remaining processors of the pipeline
+    buf = b""
+    for f in pipeline:
+        buf = f(buf)
+        if hasattr(f, 'flush'):
+            buf += f.flush()
+    return buf
+
+def filter_compile(pattern, prefix):
+    # Literal prefixes are a tuple of comma-delimited byte strings
+    if prefix:
+        return tuple(x.encode() for x in pattern.split(",") if len(x) > 0)
+    return re.compile(pattern.encode())
+
+def output_pipeline_build(options, stats=None):
+    # Histogram mode analyzes the received bytes as is
+    if options['output_mode'] == 'histogram':
+        return [output_processor_histogram()]
 
-    ### Prepare our output pipeline
     output_pipeline = []
     # Receive newline substitution
-    if RX_Newline_Sub[Format_Options['receive_newline']] is not None:
-        output_pipeline.append(output_processor_newline(RX_Newline_Sub[Format_Options['receive_newline']]))
+    if RX_Newline_Sub[options['receive_newline']] is not None:
+        output_pipeline.append(output_processor_newline(RX_Newline_Sub[options['receive_newline']]))
+    # Line filter
+    if options['rx_include'] is not None or options['rx_exclude'] is not None:
+        include = filter_compile(options['rx_include'], options['rx_filter_prefix']) if options['rx_include'] is not None else None
+        exclude = filter_compile(options['rx_exclude'], options['rx_filter_prefix']) if options['rx_exclude'] is not None else None
+        output_pipeline.append(output_processor_filter(include, exclude, stats))
     # Raw mode
-    if Format_Options['output_mode'] == 'raw':
-        output_pipeline.append(output_processor_raw(Format_Options['color_chars']))
+    if options['output_mode'] == 'raw':
+        # Line timestamps, ahead of color coding, which may color code the
+        # newlines that delimit lines
+        if options['timestamp'] != 'none':
+            output_pipeline.append(output_processor_timestamp(options['timestamp']))
+        output_pipeline.append(output_processor_raw(options['color_chars']))
     # Split mode
-    elif Format_Options['output_mode'] == 'split':
-        output_pipeline.append(output_processor_split(Format_Options['color_chars']))
+    elif options['output_mode'] == 'split':
+        output_pipeline.append(output_processor_split(options['color_chars']))
     # Split full mode
-    elif Format_Options['output_mode'] == 'splitfull':
-        output_pipeline.append(output_processor_split(Format_Options['color_chars'], partial_lines=False))
+    elif options['output_mode'] == 'splitfull':
+        output_pipeline.append(output_processor_split(options['color_chars'], partial_lines=False))
     # Hexadecimal mode
-    elif Format_Options['output_mode'] == 'hex':
-        output_pipeline.append(output_processor_hexadecimal(Format_Options['color_chars']))
+    elif options['output_mode'] == 'hex':
+        output_pipeline.append(output_processor_hexadecimal(options['color_chars']))
     # Hexadecimal with newlines mode
-    elif Format_Options['output_mode'] == 'hexnl':
-        output_pipeline.append(output_processor_hexadecimal(Format_Options['color_chars'], interpret_newlines=True))
+    elif options['output_mode'] == 'hexnl':
+        output_pipeline.append(output_processor_hexadecimal(options['color_chars'], interpret_newlines=True))
+
+    return output_pipeline
+
+###############################################################################
+### Scrollback Buffer
+###############################################################################
+
+class Scrollback(object):
+    """Fixed size ring buffer of received bytes, with an index of line start
+    offsets and arrival times. Lines end with any of the newline
+    characters."""
+
+    def __init__(self, size, max_lines=None, newline=b"\n"):
+        if max_lines is None:
+            max_lines = max(size // 16, 1)
+
+        self.set_newline(newline)
+
+        # Preallocated ring buffer of received bytes
+        self.data = bytearray(size)
+        self.size = size
+        # Total number of bytes appended
+        self.count = 0
+
+        # Preallocated ring buffers of line start offsets and arrival times
+        self.line_offsets = array.array('L', [0]) * max_lines
+        self.line_times = array.array('d', [0.0]) * max_lines
+        self.max_lines = max_lines
+        # Total number of lines indexed
+        self.line_count = 0
+        self.at_line_start = True
+
+    def set_newline(self, newline):
+        self.newline = newline
+        self.newline_re = re.compile(b"[" + re.escape(newline) + b"]")
+
+    def _index_line(self, offset, t):
+        i = self.line_count % self.max_lines
+        self.line_offsets[i] = offset
+        self.line_times[i] = t
+        self.line_count += 1
+
+    def append(self, buf, t):
+        n = len(buf)
+        if n == 0:
+            return
+
+        # Index the start offset of each line in buf
+        if self.at_line_start:
+            self._index_line(self.count, t)
+        for match in self.newline_re.finditer(buf, 0, n - 1):
+            self._index_line(self.count + match.end(), t)
+        self.at_line_start = buf[-1:] in self.newline
+
+        # Copy the tail of buf that fits into the ring buffer
+        m = min(n, self.size)
+        pos = (self.count + n - m) % self.size
+        first = min(m, self.size - pos)
+        self.data[pos:pos + first] = buf[n - m:n - m + first]
+        self.data[0:m - first] = buf[n - m + first:]
+
+        self.count += n
+
+    def contents(self):
+        """Return the absolute offset of the oldest byte held and a copy of
+        the held bytes."""
+        if self.count <= self.size:
+            return 0, bytes(self.data[0:self.count])
+
+        pos = self.count % self.size
+        return self.count - self.size, bytes(self.data[pos:] + self.data[:pos])
+
+    def line_lookup(self, offset):
+        """Return the start offset and arrival time of the indexed line
+        containing the absolute offset, or None if it is no longer indexed."""
+        lo = max(0, self.line_count - self.max_lines)
+        hi = self.line_count
+
+        # Binary search for the last line starting at or before offset
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self.line_offsets[mid % self.max_lines] <= offset:
+                lo = mid + 1
+            else:
+                hi = mid
+
+        if lo == max(0, self.line_count - self.max_lines):
+            return None
+
+        i = (lo - 1) % self.max_lines
+        return self.line_offsets[i], self.line_times[i]
+
+    def region(self, offset, data, match_start, match_end):
+        """Return the start and end of the region of data, held from the
+        absolute offset, to display for a match, and the arrival time of its
+        line or None if unknown. The region spans the lines containing the
+        match, up to Scrollback_Render_Context bytes around the match and
+        Scrollback_Render_Max bytes in total."""
+        lo = max(0, match_start - Scrollback_Render_Context)
+        hi = min(len(data), match_end + Scrollback_Render_Context)
+
+        # Look up the start of the line containing the match
+        line = self.line_lookup(offset + match_start)
+        if line is not None and line[0] >= offset:
+            start, line_time = max(line[0] - offset, lo), line[1]
+        else:
+            start = max(data.rfind(self.newline[i:i+1], lo, match_start) for i in range(len(self.newline))) + 1
+            start, line_time = max(start, lo), None
+
+        # Find the end of the line containing the end of the match
+        match = self.newline_re.search(data, max(match_end - 1, match_start), hi)
+        end = match.end() if match is not None else hi
+
+        return start, min(end, start + Scrollback_Render_Max), line_time
+
+###############################################################################
+### Histogram
+###############################################################################
 
-    # Select between serial port and stdin file descriptors
-    read_fds = [serial_fd, stdin_fd]
+class Histogram(object):
+    """Counters of received byte values, chunk sizes, and gaps between
+    chunks, with chunk sizes and gaps counted in power of two bins."""
+
+    def __init__(self):
+        self.values = array.array('L', [0]) * 256
+        # Bin k counts chunk sizes in [2^(k-1), 2^k) bytes
+        self.sizes = array.array('L', [0]) * Histogram_Bins
+        # Bin k counts gaps in [2^(k-1), 2^k) microseconds, bin 0 gaps under
+        # a microsecond
+        self.gaps = array.array('L', [0]) * Histogram_Bins
+
+        self.bytes = 0
+        self.chunks = 0
+        self.start = None
+        self.last = None
+
+    def update(self, buf, t):
+        n = len(buf)
+        if n == 0:
+            return
+
+        # Count byte values, with the C counting loop of collections.Counter
+        # for larger chunks
+        if n < Histogram_Counter_Threshold:
+            for c in bytearray(buf):
+                self.values[c] += 1
+        else:
+            for c, count in collections.Counter(bytearray(buf)).items():
+                self.values[c] += count
+
+        self.sizes[min(n.bit_length(), Histogram_Bins - 1)] += 1
+
+        if self.last is not None:
+            gap = int(max(0.0, t - self.last)*1e6)
+            self.gaps[min(gap.bit_length(), Histogram_Bins - 1)] += 1
+        else:
+            self.start = t
+        self.last = t
+
+        self.bytes += n
+        self.chunks += 1
+
+    def entropy(self):
+        """Return the Shannon entropy of byte values in bits per byte."""
+        if self.bytes == 0:
+            return 0.0
+        return sum(c * math.log(float(self.bytes) / c, 2) for c in self.values if c > 0) / self.bytes
+
+    def render(self):
+        """Return a text summary of the counters."""
+        def bar(count, total):
+            return "%12d %6.2f%% %s" % (count, 100.0 * count / total, "#" * int(round(Histogram_Bar_Width * float(count) / max(total, 1))))
+
+        def gap_format(us):
+            if us < 1000:
+                return "%d us" % us
+            elif us < 1000000:
+                return "%.3g ms" % (us / 1e3)
+            return "%.3g s" % (us / 1e6)
+
+        lines = []
+        duration = (self.last - self.start) if self.start is not None else 0.0
+        lines.append("Received %s in %d chunks over %.3f s" % (format_size(self.bytes), self.chunks, duration))
+        lines.append("")
+
+        # Most frequent byte values
+        distinct = sum(1 for c in self.values if c > 0)
+        lines.append("Byte values: %d distinct, %.3f bits/byte entropy" % (distinct, self.entropy()))
+        top = sorted((c for c in range(256) if self.values[c] > 0), key=lambda c: -self.values[c])[:Histogram_Top_Values]
+        for c in top:
+            char = chr(c) if 0x20 <= c < 0x7f else "."
+            lines.append("  0x%02x %s %s" % (c, char, bar(self.values[c], self.bytes)))
+        lines.append("")
+
+        # Chunk sizes
+        lines.append("Chunk sizes:")
+        for k in range(1, Histogram_Bins):
+            if self.sizes[k] > 0:
+                lines.append("  %-20s %s" % ("%d-%d B" % (1 << (k - 1), (1 << k) - 1), bar(self.sizes[k], self.chunks)))
+        lines.append("")
+
+        # Gaps between chunks
+        lines.append("Chunk gaps:")
+        for k in range(Histogram_Bins):
+            if self.gaps[k] > 0:
+                label = "< 1 us" if k == 0 else "%s-%s" % (gap_format(1 << (k - 1)), gap_format(1 << k))
+                lines.append("  %-20s %s" % (label, bar(self.gaps[k], self.chunks - 1)))
+
+        return os.linesep.join(lines) + os.linesep
+
+    def dump(self):
+        """Return the raw counts as comma-separated kind, bin start, bin end
+        (exclusive), and count lines."""
+        lines = ["# bytes %d, chunks %d" % (self.bytes, self.chunks), "kind,start,end,count"]
+        for c in range(256):
+            lines.append("byte,%d,%d,%d" % (c, c + 1, self.values[c]))
+        for k in range(1, Histogram_Bins):
+            lines.append("size_bytes,%d,%d,%d" % (1 << (k - 1), 1 << k, self.sizes[k]))
+        for k in range(Histogram_Bins):
+            lines.append("gap_us,%d,%d,%d" % (0 if k == 0 else 1 << (k - 1), 1 << k, self.gaps[k]))
+        return "\n".join(lines) + "\n"
+
+###############################################################################
+### Transmit Scheduler
+###############################################################################
+
+class TransmitScheduler(object):
+    """Paces transmitted data for devices without flow control.
+
+    Data is sent a byte at a time with an inter-byte delay, or a line at a
+    time with an inter-line delay, and optionally waits for the echo of each
+    line before sending the next. In adaptive mode, data is sent in windows
+    of bytes, each of which waits for its echo: the window grows while
+    echoes match, and shrinks, then slows to an inter-byte delay, when they
+    don't, to converge on the fastest rate the device accepts without loss.
+    """
+
+    def __init__(self, char_delay=0.0, line_delay=0.0, echo_wait=False, adaptive=False, newline=b"\n"):
+        self.char_delay = char_delay
+        self.line_delay = line_delay
+        self.echo_wait = echo_wait
+        self.adaptive = adaptive
+        self.newline = newline
+
+        self.buf = bytearray()
+        self.next_time = 0.0
+        self.echo = None
+
+        # Adaptive state
+        self.window = 1
+        self.delay = 0.0
+        self.losses = 0
+        self.rtt = None
+
+    def push(self, buf):
+        self.buf += buf
+
+    def cancel(self):
+        n = len(self.buf)
+        self.buf = bytearray()
+        self.echo = None
+        return n
+
+    def pending(self):
+        return len(self.buf)
+
+    def poll(self, now):
+        """Return the data to send now, and the time of the next poll, or
+        None if there is nothing left to send."""
+        # Wait for the echo
+        if self.echo is not None:
+            if now < self.echo[1]:
+                return b"", self.echo[1]
+            self._echo_done(False)
+
+        if len(self.buf) == 0:
+            return b"", None
+        elif now < self.next_time:
+            return b"", self.next_time
+
+        # Pick the next chunk to send
+        if self.adaptive:
+            n = self.window
+        elif self.char_delay > 0:
+            n = 1
+        elif self.line_delay > 0 or self.echo_wait:
+            n = self.buf.find(self.newline) + 1
+            if n == 0:
+                n = len(self.buf)
+        else:
+            n = len(self.buf)
+
+        chunk = bytes(self.buf[:n])
+        del self.buf[:n]
+
+        # Schedule the next chunk
+        end_of_line = chunk.endswith(self.newline)
+        delay = self.delay if self.adaptive else self.char_delay
+        if end_of_line:
+            delay = max(delay, self.line_delay)
+        self.next_time = now + delay
+
+        # Wait for the echo of the chunk
+        if self.adaptive or (self.echo_wait and end_of_line):
+            timeout = TX_Echo_Timeout
+            if self.adaptive and self.rtt is not None:
+                timeout = min(timeout, max(TX_Adaptive_Min_Timeout, 4*self.rtt))
+            # Echo state: [expected echo, deadline, received echo, sent time]
+            self.echo = [chunk, now + timeout, b"", now]
+            return chunk, self.echo[1]
+
+        return chunk, (self.next_time if len(self.buf) > 0 else None)
+
+    def receive(self, buf, now):
+        """Process received data for echoes."""
+        if self.echo is None:
+            return
+
+        self.echo[2] += buf
+
+        if self.adaptive:
+            # Compare the echo with newlines removed, as devices often
+            # translate them
+            expected = self.echo[0].translate(None, b"\r\n")
+            received = self.echo[2].translate(None, b"\r\n")
+            if expected in received:
+                # Update the smoothed echo round trip time
+                rtt = now - self.echo[3]
+                self.rtt = rtt if self.rtt is None else (7*self.rtt + rtt) / 8
+                self._echo_done(True)
+            elif len(received) >= 2*len(expected) + TX_Echo_Slack:
+                self._echo_done(False)
+        elif self.newline in self.echo[2]:
+            self._echo_done(True)
+
+    def _echo_done(self, matched):
+        self.echo = None
+
+        if not self.adaptive:
+            return
+
+        if matched:
+            # Speed up: remove the inter-byte delay, then grow the window
+            if self.delay > 0:
+                self.delay = self.delay / 2 if self.delay >= 2*TX_Adaptive_Min_Delay else 0.0
+            else:
+                self.window = min(self.window + 1, TX_Adaptive_Max_Window)
+        else:
+            # Slow down: shrink the window, then add an inter-byte delay
+            self.losses += 1
+            if self.window > 1:
+                self.window = max(1, self.window // 2)
+            else:
+                self.delay = max(TX_Adaptive_Min_Delay, self.delay * 2)
+
+###############################################################################
+### Output Queue
+###############################################################################
+
+class OutputQueue(object):
+    """Queue of formatted output pending for stdout, with a display latency
+    budget. Received data may be held back from formatting, e.g. while a
+    prompt is open, up to a limit. Once received data can't be displayed
+    within the budget, or held back data exceeds the limit, pending, held,
+    and newly received data is skipped until stdout catches up, and then
+    summarized in its place."""
+
+    def __init__(self, max_latency=0.0, max_held=Held_Queue_Max):
+        self.max_latency = max_latency
+        self.max_held = max_held
+
+        # Entries of [receive time, raw length, formatted buffer]. Raw length
+        # is None for messages.
+        self.queue = collections.deque()
+        self.pending = 0
+
+        # Entries of [receive time, buffer] held back from formatting
+        self.held = collections.deque()
+        self.held_bytes = 0
+
+        # Skipped data start time, time skipping began, and byte count
+        self.skipping = None
+
+        # Time since which reads have been returning full buffers, i.e. the
+        # serial port has had more data pending than we could keep up with
+        self.behind = None
+
+    def append(self, buf, t, raw_len=None):
+        if len(buf) == 0:
+            return
+        self.queue.append([t, raw_len, buf])
+        self.pending += len(buf)
+
+    def write(self, fd):
+        """Write up to WRITE_BUF_SIZE bytes of the oldest entry to fd."""
+        entry = self.queue[0]
+
+        try:
+            n = os.write(fd, entry[2][:WRITE_BUF_SIZE])
+        except Exception as err:
+            raise Exception("Error writing to stdout: %s\n" % str(err))
+
+        self.pending -= n
+        if n == len(entry[2]):
+            self.queue.popleft()
+        else:
+            entry[2] = entry[2][n:]
+
+    def flush(self, fd):
+        while len(self.queue) > 0:
+            self.write(fd)
+
+    def clear(self):
+        self.queue.clear()
+        self.pending = 0
+
+    def readable(self):
+        """Return whether to read more received data, applying backpressure
+        when the latency budget is disabled."""
+        return self.max_latency > 0 or self.pending < Output_Queue_Max
+
+    def read_update(self, full, now):
+        """Keep track of how long reads have been returning full buffers."""
+        if not full:
+            self.behind = None
+        elif self.behind is None:
+            self.behind = now
+
+    def latency(self, now):
+        # Age of the oldest pending or held received data
+        latency = 0
+        for entry in self.queue:
+            if entry[1] is not None:
+                latency = now - entry[0]
+                break
+        if len(self.held) > 0:
+            latency = max(latency, now - self.held[0][0])
+
+        # Time we've been behind the serial port
+        if self.behind is not None:
+            latency = max(latency, now - self.behind)
+
+        return latency
+
+    def overloaded(self, now):
+        return self.skipping is None and (self.held_bytes > self.max_held or (self.max_latency > 0 and self.latency(now) > self.max_latency))
+
+    def overload(self, now):
+        """Skip pending and held received data, keeping messages."""
+        start = now - self.latency(now)
+
+        skipped = sum(entry[1] for entry in self.queue if entry[1] is not None) + self.held_bytes
+        self.queue = collections.deque(entry for entry in self.queue if entry[1] is None)
+        self.pending = sum(len(entry[2]) for entry in self.queue)
+        self.held = collections.deque()
+        self.held_bytes = 0
+
+        self.skipping = {'start': start, 'since': now, 'bytes': skipped}
+
+    def skip(self, n):
+        self.skipping['bytes'] += n
+
+    def resume_time(self):
+        """Return the time display may resume after skipping."""
+        return self.skipping['since'] + self.max_latency
+
+    def resume(self, now):
+        """Queue a summary of the skipped data in its place, and return the
+        number of bytes skipped."""
+        skipping, self.skipping = self.skipping, None
+
+        elapsed = int(now - skipping['start'])
+        summary = "[skipped %s, %02d:%02d:%02d]" % (format_size(skipping['bytes']), elapsed // 3600, (elapsed // 60) % 60, elapsed % 60)
+        self.append(os.linesep.encode() + summary.encode() + os.linesep.encode(), now)
+
+        return skipping['bytes']
+
+    def hold(self, buf, t):
+        self.held.append([t, buf])
+        self.held_bytes += len(buf)
+
+    def release(self):
+        """Return the oldest held back entry of [receive time, buffer]."""
+        entry = self.held.popleft()
+        self.held_bytes -= len(entry[1])
+        return entry
+
+###############################################################################
+### Main Read/Write Loop
+###############################################################################
+
+def reconfigure_parse(text, tty_options, format_options):
+    # Parse space-delimited option=value assignments into copies of the
+    # options
+    tty_options = dict(tty_options)
+    format_options = dict(format_options)
+
+    for assignment in text.split():
+        key, _, value = assignment.partition("=")
+        if key not in Reconfigure_Options:
+            raise ValueError("Unknown option \"%s\", expected one of: %s" % (key, ", ".join(sorted(Reconfigure_Options))))
+
+        options_key, valid = Reconfigure_Options[key]
+        if valid is int:
+            try:
+                value = int(value, 10)
+            except ValueError:
+                raise ValueError("Invalid %s \"%s\"" % (key, value))
+            if value <= 0:
+                raise ValueError("Invalid %s \"%s\"" % (key, value))
+        else:
+            # Accept integer values listed as valid
+            if value.isdigit() and int(value, 10) in valid:
+                value = int(value, 10)
+            if value not in valid:
+                raise ValueError("Invalid %s \"%s\", expected one of: %s" % (key, value, ", ".join(str(x) for x in valid)))
+
+        if options_key in tty_options:
+            tty_options[options_key] = value
+        else:
+            format_options[options_key] = value
+
+    # Timestamps are only supported in raw output mode
+    if format_options['timestamp'] != 'none' and format_options['output_mode'] != 'raw':
+        raise ValueError("Timestamps are only supported in raw output mode")
+
+    return tty_options, format_options
+
+def transmit_newline_char(options):
+    # Last character of the transmitted newline, which ends a line for
+    # transmit pacing
+    sub = TX_Newline_Sub[options['transmit_newline']]
+    return sub[-1:] if sub else os.linesep.encode()[-1:]
+
+def receive_newline_chars(options):
+    # Characters that end received lines, for the scrollback line index
+    if options['receive_newline'] == 'crorlf':
+        return b"\r\n"
+    sub = RX_Newline_Sub[options['receive_newline']]
+    return sub[-1:] if sub is not None else b"\n"
+
+def options_summary(tty_options, format_options):
+    return "baudrate: %s | databits: %d | parity: %s | stopbits: %d | flowctrl: %s | output mode: %s | rx newline: %s | input mode: %s | tx newline: %s" % \
+        (tty_options['baudrate'], tty_options['databits'], tty_options['parity'], tty_options['stopbits'], tty_options['flow_control'],
+         format_options['output_mode'], format_options['receive_newline'], format_options['input_mode'], format_options['transmit_newline'])
+
+def format_size(size):
+    # Format a byte count with a decimal unit prefix
+    for unit in ["B", "KB", "MB"]:
+        if size < 1000:
+            break
+        size /= 1000.0
+    else:
+        unit = "GB"
+
+    return ("%d %s" if unit == "B" else "%.1f %s") % (size, unit)
+
+def format_time(t):
+    # Format a wall-clock time as time of day with microseconds
+    return "%s.%06d" % (time.strftime("%H:%M:%S", time.localtime(t)), int((t - int(t))*1e6))
+
+def read_write_loop(serial_fd, stdin_fd, stdout_fd, capture_fd=None):
+    # Convert constants to byte strings
+    linesep = os.linesep.encode()
+
+    # Session statistics
+    stats = {'rx_bytes': 0, 'tx_bytes': 0, 'filtered_bytes': 0, 'filtered_lines': 0, 'skipped_bytes': 0}
+
+    ### Prepare our input and output pipelines
+    pipelines = {'input': input_pipeline_build(Format_Options), 'output': output_pipeline_build(Format_Options, stats)}
+
+    ### Prepare our transmit scheduler
+    scheduler = TransmitScheduler(Format_Options['tx_char_delay'] / 1000.0, Format_Options['tx_line_delay'] / 1000.0,
+                                  Format_Options['tx_echo_wait'], Format_Options['tx_pace_auto'], transmit_newline_char(Format_Options))
+
+    ### Start our modem line monitor thread
+    modem_fd = None
+    if Format_Options['modem_lines']:
+        modem_fd, modem_event_fd = os.pipe()
+        monitor = threading.Thread(target=serial_modem_lines_monitor, args=(serial_fd, modem_event_fd))
+        monitor.daemon = True
+        monitor.start()
+
+    ### Prepare our scrollback buffer
+    scrollback = Scrollback(Format_Options['scrollback_size'], newline=receive_newline_chars(Format_Options)) if Format_Options['scrollback_size'] > 0 else None
+
+    # Command state: pending command character and open prompt
+    command = {'pending': False, 'prompt': None}
+
+    # Output queue pending for stdout, and received data held back from
+    # display while a prompt is open
+    output = OutputQueue(Format_Options['max_latency'] / 1000.0)
+
+    def write_stdout(buf, t=None, raw_len=None):
+        output.append(buf, t if t is not None else clock_monotonic(), raw_len)
+
+    def output_process(buf, t):
+        raw_len = len(buf)
+
+        # Process the buffer through our output pipeline
+        for f in pipelines['output']:
+            buf = f(buf)
+
+        # Write the buffer to stdout
+        write_stdout(buf, t, raw_len)
+
+    def write_serial(buf):
+        try:
+            os.write(serial_fd, buf)
+        except Exception as err:
+            raise Exception("Error writing to serial port: %s\n" % str(err))
+
+    def message(text):
+        write_stdout(linesep + b"[ssterm] " + text.encode() + linesep)
+
+    def prompt_open(label, callback):
+        command['prompt'] = [label, b"", callback]
+        write_stdout(linesep + b"[ssterm] " + label.encode())
+
+    def held_release():
+        # Display all received buffers held back while a prompt was open
+        while len(output.held) > 0:
+            t, buf = output.release()
+            output_process(buf, t)
+
+    def prompt_close():
+        # Held back received buffers are displayed by the main loop
+        command['prompt'] = None
+
+    def prompt_feed(c):
+        label, text, callback = command['prompt']
+
+        # Enter submits the prompt
+        if c in (0x0d, 0x0a):
+            write_stdout(linesep)
+            command['prompt'] = None
+            callback(text)
+            if command['prompt'] is None:
+                prompt_close()
+        # Escape or Ctrl-C cancels the prompt
+        elif c in (0x1b, 0x03):
+            write_stdout(linesep)
+            prompt_close()
+        # Backspace or delete erases a character
+        elif c in (0x08, 0x7f):
+            if len(text) > 0:
+                command['prompt'][1] = text[:-1]
+                write_stdout(b"\b \b")
+        # Printable characters are accumulated
+        elif c >= 0x20:
+            command['prompt'][1] = text + bytes(bytearray([c]))
+            write_stdout(bytes(bytearray([c])))
+
+    def scrollback_search(literal):
+        def search(pattern):
+            if len(pattern) == 0:
+                return
+
+            try:
+                regex = re.compile(re.escape(pattern) if literal else pattern)
+            except re.error as err:
+                message("Invalid regular expression: %s" % str(err))
+                return
+
+            prompt_open("render mode [%s]: " % Format_Options['output_mode'], lambda mode: scrollback_render(regex, mode))
+        return search
+
+    def scrollback_render(regex, mode):
+        mode = mode.decode() if len(mode) > 0 else Format_Options['output_mode']
+        if mode not in Output_Modes:
+            message("Invalid output mode!")
+            return
+
+        start, data = scrollback.contents()
+
+        # Keep the most recent matches
+        matches = collections.deque(regex.finditer(data), Scrollback_Search_Results)
+        if len(matches) == 0:
+            message("No matches found.")
+            return
+
+        for i, match in enumerate(matches):
+            region_start, region_end, line_time = scrollback.region(start, data, match.start(), match.end())
+
+            if line_time is not None:
+                received = format_time(line_time)
+            else:
+                received = "unknown"
+            message("Match %d/%d at offset %d, received %s" % (i + 1, len(matches), start + match.start(), received))
+
+            # Render the region in the selected output mode, including data
+            # held back by the pipeline
+            pipeline = output_pipeline_build(dict(Format_Options, output_mode=mode, timestamp='none', rx_include=None, rx_exclude=None))
+            buf = data[region_start:region_end]
+            for f in pipeline:
+                buf = f(buf)
+            buf += pipeline_flush(pipeline)
+            write_stdout(buf if buf.endswith(linesep) else buf + linesep)
+
+    def reconfigure(tty_options, format_options):
+        # Reconfigure the serial port in place
+        if tty_options != TTY_Options:
+            try:
+                serial_configure(serial_fd, tty_options['baudrate'], tty_options['databits'], tty_options['stopbits'], tty_options['parity'], tty_options['flow_control'], tty_options['low_latency'])
+            except Exception as err:
+                message(str(err))
+                return
+            TTY_Options.update(tty_options)
+
+        # Rebuild our pipelines, after displaying held back data and data
+        # held back by the old output pipeline
+        if format_options != Format_Options:
+            held_release()
+            write_stdout(pipeline_flush(pipelines['output']), raw_len=0)
+            Format_Options.update(format_options)
+            pipelines['input'] = input_pipeline_build(Format_Options)
+            pipelines['output'] = output_pipeline_build(Format_Options, stats)
+            scheduler.newline = transmit_newline_char(Format_Options)
+            if scrollback is not None:
+                scrollback.set_newline(receive_newline_chars(Format_Options))
+
+        message(options_summary(TTY_Options, Format_Options))
+
+    def reconfigure_prompt(text):
+        try:
+            tty_options, format_options = reconfigure_parse(text.decode(), TTY_Options, Format_Options)
+        except ValueError as err:
+            message(str(err))
+            return
+
+        reconfigure(tty_options, format_options)
+
+    def reconfigure_baudrate_step(step):
+        baudrates = sorted(Termios_Baudrates)
+        if step > 0:
+            candidates = [b for b in baudrates if b > TTY_Options['baudrate']]
+        else:
+            candidates = [b for b in reversed(baudrates) if b < TTY_Options['baudrate']]
+
+        if len(candidates) == 0:
+            message("No %s baudrate." % ("higher" if step > 0 else "lower"))
+            return
+
+        reconfigure(dict(TTY_Options, baudrate=candidates[0]), Format_Options)
+
+    def command_process(c):
+        if c == ord(Command_Escape_Character):
+            # Pass a doubled command escape character through to the serial port
+            return bytes(bytearray([c]))
+        elif c in (ord('/'), ord('f')):
+            if scrollback is None:
+                message("Scrollback is disabled.")
+            else:
+                prompt_open("search %s: " % ("regex" if c == ord('/') else "literal"), scrollback_search(c == ord('f')))
+        elif c in (ord('d'), ord('r')):
+            name, line = ("DTR", termios.TIOCM_DTR) if c == ord('d') else ("RTS", termios.TIOCM_RTS)
+            try:
+                message("%s %s" % (name, "raised" if serial_modem_lines_toggle(serial_fd, line) else "lowered"))
+            except Exception as err:
+                message(str(err))
+        elif c == ord('k'):
+            try:
+                termios.tcsendbreak(serial_fd, 0)
+                message("Break sent")
+            except termios.error as err:
+                message("Sending break: %s" % str(err))
+        elif c == ord('c'):
+            prompt_open("configure, e.g. baudrate=9600 output=split: ", reconfigure_prompt)
+        elif c in (ord('+'), ord('-')):
+            reconfigure_baudrate_step(1 if c == ord('+') else -1)
+        elif c == ord('i'):
+            message(options_summary(TTY_Options, Format_Options))
+        elif c == ord('x'):
+            message("Cancelled %d bytes of pending transmit data" % scheduler.cancel())
+        elif c == ord('s'):
+            message("RX: %d bytes | TX: %d bytes, %d pending | Filtered: %d bytes, %d lines | Skipped: %d bytes" % (stats['rx_bytes'], stats['tx_bytes'], scheduler.pending(), stats['filtered_bytes'], stats['filtered_lines'], stats['skipped_bytes']))
+            if scheduler.adaptive:
+                message("TX pacing: %d byte window | %.1f ms inter-byte delay | %.1f ms echo round trip | %d losses" % (scheduler.window, scheduler.delay*1e3, (scheduler.rtt or 0)*1e3, scheduler.losses))
+        elif c == ord('?'):
+            message("Commands: c configure, +/- baudrate up/down, i show configuration, / regex search, f literal search, d toggle DTR, r toggle RTS, k send break, x cancel transmit, s statistics, Ctrl-T send Ctrl-T")
+        else:
+            message("Unknown command, Ctrl-T ? for help.")
+
+        return b""
 
     while True:
-        ready_read_fds, _, _ = select.select(read_fds, [], [])
+        now = clock_monotonic()
+        timeout = None
+
+        # Write scheduled transmit data to the serial port
+        buf, tx_time = scheduler.poll(now)
+        if len(buf) > 0:
+            write_serial(buf)
+            stats['tx_bytes'] += len(buf)
+        if tx_time is not None:
+            timeout = max(0, tx_time - now)
+
+        # Display one held back received buffer per iteration after a prompt
+        # closes, so stdin stays responsive
+        if command['prompt'] is None and len(output.held) > 0 and output.pending < Output_Queue_Max:
+            t, buf = output.release()
+            output_process(buf, t)
+            if len(output.held) > 0:
+                timeout = 0
+
+        # Refresh periodically redrawn output, e.g. histograms, that has
+        # changed since it was last drawn, unless a prompt is open
+        for f in pipelines['output']:
+            if hasattr(f, 'refresh_time') and f.refresh_time() is not None and command['prompt'] is None:
+                if f.refresh_time() <= now:
+                    write_stdout(f.refresh(now), now, 0)
+                elif timeout is None or f.refresh_time() - now < timeout:
+                    timeout = f.refresh_time() - now
+
+        # Select between serial port and stdin file descriptors, and stdout
+        # if we have output pending
+        read_fds = [stdin_fd] if modem_fd is None else [stdin_fd, modem_fd]
+        write_fds = [stdout_fd] if len(output.queue) > 0 else []
+
+        # Apply backpressure to the serial port if we're not skipping data to
+        # keep within a latency budget
+        if output.readable():
+            read_fds.append(serial_fd)
+
+        # Resume display once we've skipped data for at least the latency
+        # budget, any prompt is closed, and stdout is writable again
+        if output.skipping is not None and command['prompt'] is None:
+            resume_timeout = output.resume_time() - now
+            if resume_timeout <= 0:
+                write_fds = [stdout_fd]
+            elif timeout is None or resume_timeout < timeout:
+                timeout = resume_timeout
+
+        ready_read_fds, ready_write_fds, _ = select.select(read_fds, write_fds, [], timeout)
+
+        if stdout_fd in ready_write_fds:
+            if output.skipping is not None and command['prompt'] is None and len(output.queue) == 0:
+                stats['skipped_bytes'] += output.resume(clock_monotonic())
+            if len(output.queue) > 0:
+                output.write(stdout_fd)
+
+        if modem_fd is not None and modem_fd in ready_read_fds:
+            for event in os.read(modem_fd, READ_BUF_SIZE).splitlines():
+                # Display modem line events inline with received data
+                write_stdout(linesep + event + linesep)
+
+                # Write modem line events to the capture file
+                if capture_fd is not None:
+                    try:
+                        os.write(capture_fd, event + linesep)
+                    except Exception as err:
+                        raise Exception("Error writing to capture file: %s\n" % str(err))
 
         if stdin_fd in ready_read_fds:
             # Read a buffer from stdin
@@ -545,19 +2052,33 @@ def read_write_loop(serial_fd, stdin_fd, stdout_fd):
             except Exception as err:
                 raise Exception("Error reading stdin: %s\n" % str(err))
 
-            # If we detect the escape character, quit
+            # If we detect the escape character, discard pending output and
+            # quit
             if Quit_Escape_Character in buf:
+                output.clear()
                 break
 
+            # Interpret command escape sequences and prompt input
+            if command['pending'] or command['prompt'] is not None or Command_Escape_Character in buf:
+                nbuf = b""
+                for c in bytearray(buf):
+                    if command['prompt'] is not None:
+                        prompt_feed(c)
+                    elif command['pending']:
+                        command['pending'] = False
+                        nbuf += command_process(c)
+                    elif c == ord(Command_Escape_Character):
+                        command['pending'] = True
+                    else:
+                        nbuf += bytes(bytearray([c]))
+                buf = nbuf
+
             # Process the buffer through our input pipeline
-            for f in input_pipeline:
+            for f in pipelines['input']:
                 buf = f(buf)
 
-            # Write the buffer to the serial port
-            try:
-                os.write(serial_fd, buf)
-            except Exception as err:
-                raise Exception("Error writing to serial port: %s\n" % str(err))
+            # Schedule the buffer for writing to the serial port
+            scheduler.push(buf)
 
         if serial_fd in ready_read_fds:
             # Read a buffer from the serial port
@@ -570,32 +2091,491 @@ def read_write_loop(serial_fd, stdin_fd, stdout_fd):
             if len(buf) == 0:
                 break
 
-            # Process the buffer through our output pipeline
-            for f in output_pipeline:
-                buf = f(buf)
+            now = clock_monotonic()
+            stats['rx_bytes'] += len(buf)
+
+            # Check for echoes of transmitted data
+            scheduler.receive(buf, now)
+
+            # Write the raw buffer to the capture file
+            if capture_fd is not None:
+                try:
+                    os.write(capture_fd, buf)
+                except Exception as err:
+                    raise Exception("Error writing to capture file: %s\n" % str(err))
+
+            # Record the buffer in our scrollback
+            if scrollback is not None:
+                scrollback.append(buf, time.time())
+
+            # Keep track of how long we've been behind the serial port
+            output.read_update(len(buf) == READ_BUF_SIZE, now)
+
+            # Count the buffer into analyzer output pipelines, e.g. histograms,
+            # which see every received byte and are drawn on refresh, rather
+            # than being held back or skipped
+            analyzers = [f for f in pipelines['output'] if hasattr(f, 'update')]
+            if len(analyzers) > 0:
+                for f in analyzers:
+                    f.update(buf)
+                continue
+
+            # Hold the buffer back from display while a prompt is open, or
+            # earlier held back buffers are pending display
+            if output.skipping is None and (command['prompt'] is not None or len(output.held) > 0):
+                output.hold(buf, now)
+                buf = b""
+
+            # Skip display of pending, held back, and new data if we're over
+            # the latency budget or the held back data limit
+            if output.overloaded(now):
+                output.overload(now)
+
+            if output.skipping is not None:
+                output.skip(len(buf))
+            elif len(buf) > 0:
+                output_process(buf, now)
+
+    # Display pending output and data held back by the output pipeline, e.g.
+    # the final histogram
+    write_stdout(pipeline_flush(pipelines['output']))
+    output.flush(stdout_fd)
+
+    # Dump the counters of a histogram output pipeline
+    if Format_Options['histogram_dump'] is not None:
+        for f in pipelines['output']:
+            if hasattr(f, 'histogram'):
+                try:
+                    with open(Format_Options['histogram_dump'], 'w') as dump_file:
+                        dump_file.write(f.histogram.dump())
+                except IOError as err:
+                    raise Exception("Error writing histogram dump: %s\n" % str(err))
+
+###############################################################################
+### asyncio Serial Terminal
+###############################################################################
+
+class SerialTerminal(object):
+    """Serial terminal driven by an asyncio event loop.
+
+    Received data is processed through the output pipeline and fed to the
+    reader, an asyncio.StreamReader. Data written with write() is processed
+    through the input pipeline and written to the serial port as the port
+    becomes writable. The device may also be a server address, as with the
+    command-line client.
+
+    The terminal is the reader's transport: reading the serial port pauses
+    while the reader holds more than twice its limit of unconsumed data, and
+    resumes once it is consumed.
+
+    Example:
+        async with SerialTerminal("/dev/ttyUSB0", {'baudrate': 9600}, {'receive_newline': 'crlf'}) as term:
+            term.write(b"help\\n")
+            await term.drain()
+            line = await term.reader.readline()
+    """
+
+    def __init__(self, device_path, tty_options=None, format_options=None, input_pipeline=None, output_pipeline=None, loop=None, limit=Reader_Limit):
+        if asyncio is None:
+            raise Exception("SerialTerminal requires asyncio (Python 3.4+)")
+
+        self.device_path = device_path
+
+        # Per-instance options, with defaults from the global options
+        self.tty_options = dict(TTY_Options, **(tty_options or {}))
+        self.format_options = dict(Format_Options, **(format_options or {}))
+
+        self.stats = {'rx_bytes': 0, 'tx_bytes': 0, 'filtered_bytes': 0, 'filtered_lines': 0}
+
+        # Pipelines, built from the options unless specified
+        self.input_pipeline = input_pipeline if input_pipeline is not None else input_pipeline_build(self.format_options)
+        self.output_pipeline = output_pipeline if output_pipeline is not None else output_pipeline_build(self.format_options, self.stats)
+
+        self.loop = loop
+        self.limit = limit
+        self.fd = None
+        self.reader = None
+        self.reading = False
+
+        self._write_buf = bytearray()
+        self._drain_waiters = []
+
+    def open(self):
+        if self.fd is not None:
+            raise Exception("Serial terminal already open")
+
+        if self.loop is None:
+            self.loop = asyncio.get_event_loop()
+
+        # Connect to a server, or open the serial port
+        if socket_address_parse(self.device_path) is not None:
+            self.fd = socket_open(self.device_path)
+        else:
+            self.fd = serial_open(self.device_path, self.tty_options['baudrate'], self.tty_options['databits'], self.tty_options['stopbits'], self.tty_options['parity'], self.tty_options['flow_control'], self.tty_options['low_latency'])
+
+            # Setting the driver low latency flag is best effort, as not all
+            # drivers support it
+            if self.tty_options['low_latency']:
+                try:
+                    serial_set_low_latency(self.fd)
+                except Exception:
+                    pass
+
+        # Reads and writes are driven by the event loop
+        fcntl.fcntl(self.fd, fcntl.F_SETFL, fcntl.fcntl(self.fd, fcntl.F_GETFL) | os.O_NONBLOCK)
+
+        self.reader = asyncio.StreamReader(limit=self.limit, loop=self.loop)
+        self.reader.set_transport(self)
+        self.resume_reading()
+
+        return self
+
+    def close(self):
+        if self.fd is None:
+            return
+
+        self.pause_reading()
+        self.loop.remove_writer(self.fd)
+        serial_close(self.fd)
+        self.fd = None
+
+        if not self.reader.at_eof():
+            self.reader.feed_eof()
+
+        self._write_buf = bytearray()
+        self._drain_wakeup(Exception("Serial terminal closed"))
+
+    def write(self, buf):
+        if self.fd is None:
+            raise Exception("Serial terminal not open")
+
+        # Process the buffer through our input pipeline
+        for f in self.input_pipeline:
+            buf = f(buf)
+
+        if len(buf) == 0:
+            return
+
+        # Start writing if we weren't already
+        start = len(self._write_buf) == 0
+        self._write_buf += buf
+        if start:
+            self._write_ready()
+            if len(self._write_buf) > 0:
+                self.loop.add_writer(self.fd, self._write_ready)
+
+    def drain(self):
+        """Return a future that completes when all written data has been
+        written to the serial port."""
+        future = self.loop.create_future()
+        if len(self._write_buf) == 0:
+            future.set_result(None)
+        else:
+            self._drain_waiters.append(future)
+        return future
+
+    # Reader transport flow control
+
+    def pause_reading(self):
+        if self.reading:
+            self.loop.remove_reader(self.fd)
+            self.reading = False
+
+    def resume_reading(self):
+        if not self.reading and self.fd is not None:
+            self.loop.add_reader(self.fd, self._read_ready)
+            self.reading = True
+
+    # Asynchronous context manager support, returning futures rather than
+    # using coroutine syntax so the module remains compatible with Python 2
+
+    def __aenter__(self):
+        self.open()
+        future = self.loop.create_future()
+        future.set_result(self)
+        return future
+
+    def __aexit__(self, exc_type, exc, tb):
+        self.close()
+        future = self.loop.create_future()
+        future.set_result(False)
+        return future
+
+    def _drain_wakeup(self, exc=None):
+        waiters, self._drain_waiters = self._drain_waiters, []
+        for future in waiters:
+            if not future.done():
+                if exc is not None:
+                    future.set_exception(exc)
+                else:
+                    future.set_result(None)
+
+    def _read_ready(self):
+        # Read a buffer from the serial port
+        try:
+            buf = os.read(self.fd, READ_BUF_SIZE)
+        except OSError as err:
+            if err.errno in (errno.EAGAIN, errno.EWOULDBLOCK):
+                return
+            self.reader.set_exception(Exception("Error reading serial port: %s" % str(err)))
+            self.close()
+            return
+
+        # Close if we hit EOF
+        if len(buf) == 0:
+            self.close()
+            return
+
+        self.stats['rx_bytes'] += len(buf)
+
+        # Process the buffer through our output pipeline
+        for f in self.output_pipeline:
+            buf = f(buf)
+
+        if len(buf) > 0:
+            self.reader.feed_data(buf)
+
+    def _write_ready(self):
+        # Write as much of the buffer as the serial port accepts
+        try:
+            n = os.write(self.fd, self._write_buf)
+        except OSError as err:
+            if err.errno in (errno.EAGAIN, errno.EWOULDBLOCK):
+                return
+            self.loop.remove_writer(self.fd)
+            self._write_buf = bytearray()
+            self._drain_wakeup(Exception("Error writing to serial port: %s" % str(err)))
+            return
+
+        self.stats['tx_bytes'] += n
+        del self._write_buf[:n]
+
+        if len(self._write_buf) == 0:
+            self.loop.remove_writer(self.fd)
+            self._drain_wakeup()
+
+###############################################################################
+### Server Loop
+###############################################################################
+
+def server_loop(serial_fd, listen_sock, capture_fd=None, log=None):
+    # Client state by socket: [address, send queue, connection order]
+    clients = {}
+    connections = [0]
+    queue_size = Server_Options['queue_size']
+
+    # Serial port transmit queue, written as the serial port becomes
+    # writable, so a serial port holding off transmission with flow control
+    # doesn't stall reception
+    serial_queue = bytearray()
+    fcntl.fcntl(serial_fd, fcntl.F_SETFL, fcntl.fcntl(serial_fd, fcntl.F_GETFL) | os.O_NONBLOCK)
+
+    # Log client events to stderr, unless a log function is specified
+    if log is None:
+        def log(text):
+            sys.stderr.write("[ssterm] %s\n" % text)
+
+    def client_name(address):
+        # Unix socket clients are unnamed, so number them
+        if isinstance(address, tuple):
+            return "%s:%d" % address[0:2]
+        return "unix client %d" % connections[0]
+
+    def client_close(sock, reason):
+        log("%s disconnected: %s" % (clients[sock][0], reason))
+        del clients[sock]
+        sock.close()
+
+    def write_lock_holder():
+        # The earliest or latest connected client holds the write lock
+        if Server_Options['write_lock'] == 'none' or len(clients) == 0:
+            return None
+        elif Server_Options['write_lock'] == 'first':
+            return min(clients, key=lambda sock: clients[sock][2])
+        else:
+            return max(clients, key=lambda sock: clients[sock][2])
+
+    try:
+        while True:
+            # Stop reading from the write lock holder while the serial port
+            # transmit queue is full
+            holder = write_lock_holder()
+            read_socks = [sock for sock in clients if sock is not holder or len(serial_queue) < queue_size]
+            write_fds = [sock for sock in clients if len(clients[sock][1]) > 0]
+            if len(serial_queue) > 0:
+                write_fds.append(serial_fd)
+
+            ready_read_fds, ready_write_fds, _ = select.select([serial_fd, listen_sock] + read_socks, write_fds, [])
+
+            # Write queued data to the serial port
+            if serial_fd in ready_write_fds:
+                try:
+                    n = os.write(serial_fd, serial_queue)
+                except OSError as err:
+                    if err.errno not in (errno.EAGAIN, errno.EWOULDBLOCK):
+                        raise Exception("Error writing to serial port: %s\n" % str(err))
+                    n = 0
+
+                del serial_queue[:n]
+
+            # Accept new clients
+            if listen_sock in ready_read_fds:
+                try:
+                    sock, address = listen_sock.accept()
+                except socket.error as err:
+                    log("Error accepting client: %s" % str(err))
+                else:
+                    sock.setblocking(False)
+                    connections[0] += 1
+                    clients[sock] = [client_name(address), bytearray(), connections[0]]
+                    log("%s connected" % clients[sock][0])
+
+            # Send queued data to clients
+            for sock in ready_write_fds:
+                if sock not in clients:
+                    continue
+
+                try:
+                    n = sock.send(clients[sock][1])
+                except socket.error as err:
+                    if err.errno not in (errno.EAGAIN, errno.EWOULDBLOCK):
+                        client_close(sock, str(err))
+                    continue
+
+                del clients[sock][1][:n]
+
+            # Receive data from clients
+            holder = write_lock_holder()
+            for sock in [sock for sock in clients if sock in ready_read_fds]:
+                try:
+                    buf = sock.recv(READ_BUF_SIZE)
+                except socket.error as err:
+                    if err.errno not in (errno.EAGAIN, errno.EWOULDBLOCK):
+                        client_close(sock, str(err))
+                    continue
+
+                if len(buf) == 0:
+                    client_close(sock, "connection closed")
+                    continue
+
+                # Discard data from clients not holding the write lock
+                if sock is not holder:
+                    continue
+
+                # Queue the buffer for the serial port
+                serial_queue += buf
+
+            if serial_fd in ready_read_fds:
+                # Read a buffer from the serial port
+                try:
+                    buf = os.read(serial_fd, READ_BUF_SIZE)
+                except OSError as err:
+                    if err.errno in (errno.EAGAIN, errno.EWOULDBLOCK):
+                        continue
+                    raise Exception("Error reading serial port: %s\n" % str(err))
+
+                # Break if we hit EOF
+                if len(buf) == 0:
+                    break
+
+                # Write the raw buffer to the capture file
+                if capture_fd is not None:
+                    try:
+                        os.write(capture_fd, buf)
+                    except Exception as err:
+                        raise Exception("Error writing to capture file: %s\n" % str(err))
+
+                # Queue the buffer for each client
+                for sock in list(clients):
+                    queue = clients[sock][1]
+                    queue += buf
+
+                    # Drop slow clients, or discard their oldest queued data
+                    if len(queue) > queue_size:
+                        if Server_Options['slow_client'] == 'drop':
+                            client_close(sock, "send queue overflow")
+                        else:
+                            del queue[:len(queue) - queue_size]
+    finally:
+        for sock in list(clients):
+            client_close(sock, "server closed")
+
+###############################################################################
+### Ping Loop
+###############################################################################
+
+def percentile(values, p):
+    # Nearest-rank percentile of sorted values
+    if len(values) == 0:
+        return None
+    return values[max(0, min(len(values) - 1, int(math.ceil(p / 100.0 * len(values))) - 1))]
+
+def ping_loop(serial_fd, count):
+    rtts = []
+
+    for i in range(count):
+        # Discard any stale received data
+        termios.tcflush(serial_fd, termios.TCIFLUSH)
+
+        # Send a probe byte, varying it so a late echo of a previous probe
+        # isn't mistaken for this one
+        probe = bytes(bytearray([0x20 + (i % 0x5f)]))
+
+        t0 = clock_monotonic()
+        try:
+            os.write(serial_fd, probe)
+        except Exception as err:
+            raise Exception("Error writing to serial port: %s\n" % str(err))
+
+        # Wait for the echo of the probe
+        deadline = t0 + Ping_Timeout
+        while True:
+            timeout = deadline - clock_monotonic()
+            if timeout <= 0:
+                sys.stdout.write("probe %d: timeout\n" % i)
+                break
+
+            ready_read_fds, _, _ = select.select([serial_fd], [], [], timeout)
+            if serial_fd not in ready_read_fds:
+                continue
 
-            # Write the buffer to stdout
             try:
-                os.write(stdout_fd, buf)
+                buf = os.read(serial_fd, READ_BUF_SIZE)
             except Exception as err:
-                raise Exception("Error writing to stdout: %s\n" % str(err))
+                raise Exception("Error reading serial port: %s\n" % str(err))
+
+            if len(buf) == 0:
+                raise Exception("Serial port closed")
+
+            if probe in buf:
+                rtts.append(clock_monotonic() - t0)
+                sys.stdout.write("probe %d: %.3f ms\n" % (i, rtts[-1]*1e3))
+                break
+
+        sys.stdout.flush()
+        time.sleep(Ping_Interval)
+
+    return rtts
 
 ###############################################################################
 ### Command-Line Options Parsing and Help
 ###############################################################################
 
 def print_usage():
-    print("Usage: %s [options] <serial port device>\n"\
+    print("Usage: %s [options] <serial port device or server address>\n"\
           "\n"\
           "ssterm - simple serial-port terminal\n"\
           "https://github.com/vsergeev/ssterm\n"\
           "\n"\
           "Serial Port Options:\n"\
-          "  -b, --baudrate <rate>         Specify baudrate: e.g. 9600, 115200, etc.\n"\
+          "  -b, --baudrate <rate>         Specify baudrate: e.g. 9600, 115200, etc.,\n"\
+          "                                or auto to detect it from received data\n"\
           "  -d, --databits <number>       Specify number of data bits: 5, 6, 7, 8\n"\
           "  -p, --parity <type>           Specify parity: none, odd, even\n"\
           "  -t, --stopbits <number>       Specify number of stop bits: 1, 2\n"\
           "  -f, --flow-control <type>     Specify flow control: none, rtscts, xonxoff\n"\
+          "  --low-latency                 Configure serial port and driver for low\n"\
+          "                                receive latency\n"\
           "\n"\
           "Output Formatting Options:\n"\
           "  -o, --output <mode>           Specify output mode\n"\
@@ -604,11 +2584,34 @@ def print_usage():
           "                                  splitfull hex./ASCII split with full lines\n"\
           "                                  hex       hex.\n"\
           "                                  hexnl     hex. with newlines\n"\
+          "                                  histogram byte value, chunk size, and\n"\
+          "                                            chunk gap histograms\n"\
+          "\n"\
+          "  --histogram-dump <file>       Write histogram counts to a file on exit\n"\
           "\n"\
           "  --rx-nl <substitution>        Enable substitution of the specified newline\n"\
           "                                for the system's newline upon reception\n"\
           "                                  cr, lf, crlf, crorlf\n"\
           "\n"\
+          "  --timestamp <mode>            Prefix each line with a timestamp in raw\n"\
+          "                                output mode\n"\
+          "                                  wall      wall-clock time\n"\
+          "                                  mono      seconds since start\n"\
+          "                                  delta     seconds since previous line\n"\
+          "\n"\
+          "  --rx-include <pattern>        Only display received lines matching the\n"\
+          "                                specified regular expression\n"\
+          "  --rx-exclude <pattern>        Do not display received lines matching the\n"\
+          "                                specified regular expression\n"\
+          "  --rx-filter-prefix            Interpret --rx-include and --rx-exclude as\n"\
+          "                                comma-delimited lists of line prefixes\n"\
+          "\n"\
+          "  --modem-lines                 Display modem line (CTS, DSR, DCD, RI) changes\n"\
+          "\n"\
+          "  --max-latency <ms>            Skip and summarize received data when the\n"\
+          "                                display falls behind by more than the\n"\
+          "                                specified latency, 0 to disable (default 0)\n"\
+          "\n"\
           "  -c, --color <list>            Specify comma-delimited list of characters in\n"\
           "                                ASCII or hex. to color code: A,$,0x0d,0x0a,...\n"\
           "\n"\
@@ -623,11 +2626,51 @@ def print_usage():
           "\n"\
           "  -e, --echo                    Enable local character echo\n"\
           "\n"\
+          "  --tx-char-delay <ms>          Delay between transmitted characters\n"\
+          "  --tx-line-delay <ms>          Delay between transmitted lines\n"\
+          "  --tx-echo-wait                Wait for the echo of each transmitted line\n"\
+          "                                before transmitting the next\n"\
+          "  --tx-pace-auto                Adapt transmit pacing to the fastest rate\n"\
+          "                                the device echoes without loss\n"\
+          "\n"\
+          "Server Options:\n"\
+          "  --serve <address>             Serve the serial port to clients instead of\n"\
+          "                                the terminal: tcp:[host]:<port>, unix:<path>\n"\
+          "  --serve-write <policy>        Specify which client may write\n"\
+          "                                  first     earliest connected (default)\n"\
+          "                                  last      latest connected\n"\
+          "                                  none      no client\n"\
+          "  --serve-queue <size>          Specify client send queue size in bytes\n"\
+          "                                (default 65536)\n"\
+          "  --serve-slow <policy>         Specify handling of clients with a full\n"\
+          "                                send queue\n"\
+          "                                  drop      disconnect client (default)\n"\
+          "                                  lag       discard oldest queued data\n"\
+          "\n"\
           "Miscellaneous:\n"\
+          "  --ping <count>                Measure round-trip latency of <count> probes\n"\
+          "                                echoed by a loopback device, then quit\n"\
+          "  --capture <file>              Capture all received data to a file\n"\
+          "  --scrollback <size>           Specify scrollback buffer size in bytes,\n"\
+          "                                0 to disable (default 1048576)\n"\
           "  -h, --help                    Display this usage/help\n"\
           "  -v, --version                 Display the program's version\n\n"\
           "Quit Escape Character:          Ctrl-]\n"\
           "\n"\
+          "Command Escape Character:       Ctrl-T, followed by\n"\
+          "  c                             Change options, e.g. baudrate=9600\n"\
+          "  + / -                         Step baudrate up / down\n"\
+          "  i                             Display options\n"\
+          "  /                             Search scrollback for a regex\n"\
+          "  f                             Search scrollback for a literal\n"\
+          "  d                             Toggle DTR\n"\
+          "  r                             Toggle RTS\n"\
+          "  k                             Send break\n"\
+          "  x                             Cancel pending transmit\n"\
+          "  s                             Display statistics\n"\
+          "  ?                             List commands\n"\
+          "  Ctrl-T                        Send Ctrl-T\n"\
+          "\n"\
           "Default Options:\n"\
           " baudrate: 115200 | databits: 8 | parity: none | stopbits: 1 | flowctrl: none\n"\
           " output mode: raw | rx newline: raw | color code: none\n"\
@@ -639,21 +2682,26 @@ def print_version():
 def main():
     # Parse options
     try:
-        options, args = getopt.gnu_getopt(sys.argv[1:], "b:d:p:t:f:o:c:i:ehv", ["baudrate=", "databits=", "parity=", "stopbits=", "flow-control=", "output=", "color=", "rx-nl=", "input=", "tx-nl=", "echo", "help", "version"])
+        options, args = getopt.gnu_getopt(sys.argv[1:], "b:d:p:t:f:o:c:i:ehv", ["baudrate=", "databits=", "parity=", "stopbits=", "flow-control=", "low-latency", "output=", "color=", "rx-nl=", "timestamp=", "rx-include=", "rx-exclude=", "rx-filter-prefix", "modem-lines", "max-latency=", "input=", "tx-nl=", "echo", "tx-char-delay=", "tx-line-delay=", "tx-echo-wait", "tx-pace-auto", "serve=", "serve-write=", "serve-queue=", "serve-slow=", "ping=", "capture=", "scrollback=", "histogram-dump=", "help", "version"])
     except getopt.GetoptError as err:
         print(str(err), "\n")
         print_usage()
         sys.exit(-1)
 
+    ping_count = None
+
     # Update options containers
     for opt, opt_arg in options:
         # Serial port options
         if opt in ("-b", "--baudrate"):
-            try:
-                TTY_Options['baudrate'] = int(opt_arg, 10)
-            except ValueError:
-                sys.stderr.write("Error: Invalid tty baudrate!\n")
-                sys.exit(-1)
+            if opt_arg == "auto":
+                TTY_Options['baudrate'] = "auto"
+            else:
+                try:
+                    TTY_Options['baudrate'] = int(opt_arg, 10)
+                except ValueError:
+                    sys.stderr.write("Error: Invalid tty baudrate!\n")
+                    sys.exit(-1)
         elif opt in ("-d", "--databits"):
             try:
                 TTY_Options['databits'] = int(opt_arg, 10)
@@ -670,10 +2718,12 @@ def main():
                 sys.exit(-1)
         elif opt in ("-f", "--flow-control"):
             TTY_Options['flow_control'] = opt_arg
+        elif opt == "--low-latency":
+            TTY_Options['low_latency'] = True
 
         # Output Formatting Options
         elif opt in ("-o", "--output"):
-            if not opt_arg in ["raw", "split", "splitfull", "hex", "hexnl"]:
+            if not opt_arg in Output_Modes:
                 sys.stderr.write("Error: Invalid output mode!\n")
                 print_usage()
                 sys.exit(-1)
@@ -721,10 +2771,100 @@ def main():
                 print_usage()
                 sys.exit(-1)
             Format_Options['receive_newline'] = opt_arg
+        elif opt == "--timestamp":
+            if not opt_arg in Timestamp_Modes:
+                sys.stderr.write("Error: Invalid timestamp mode!\n")
+                print_usage()
+                sys.exit(-1)
+            Format_Options['timestamp'] = opt_arg
+        elif opt == "--rx-include":
+            Format_Options['rx_include'] = opt_arg
+        elif opt == "--rx-exclude":
+            Format_Options['rx_exclude'] = opt_arg
+        elif opt == "--rx-filter-prefix":
+            Format_Options['rx_filter_prefix'] = True
+        elif opt == "--modem-lines":
+            Format_Options['modem_lines'] = True
+        elif opt == "--max-latency":
+            try:
+                Format_Options['max_latency'] = int(opt_arg, 10)
+            except ValueError:
+                sys.stderr.write("Error: Invalid maximum latency!\n")
+                sys.exit(-1)
+            if Format_Options['max_latency'] < 0:
+                sys.stderr.write("Error: Invalid maximum latency!\n")
+                sys.exit(-1)
         elif opt in ("-e", "--echo"):
             Format_Options['echo'] = True
+        elif opt in ("--tx-char-delay", "--tx-line-delay"):
+            key = opt[2:].replace('-', '_')
+            try:
+                Format_Options[key] = float(opt_arg)
+            except ValueError:
+                sys.stderr.write("Error: Invalid transmit delay!\n")
+                sys.exit(-1)
+            if Format_Options[key] < 0:
+                sys.stderr.write("Error: Invalid transmit delay!\n")
+                sys.exit(-1)
+        elif opt == "--tx-echo-wait":
+            Format_Options['tx_echo_wait'] = True
+        elif opt == "--tx-pace-auto":
+            Format_Options['tx_pace_auto'] = True
+
+        # Server Options
+        elif opt == "--serve":
+            try:
+                if socket_address_parse(opt_arg) is None:
+                    raise ValueError("Invalid server address \"%s\", expected tcp:[host]:<port> or unix:<path>" % opt_arg)
+            except ValueError as err:
+                sys.stderr.write("Error: %s\n" % str(err))
+                sys.exit(-1)
+            Server_Options['address'] = opt_arg
+        elif opt == "--serve-write":
+            if not opt_arg in ["first", "last", "none"]:
+                sys.stderr.write("Error: Invalid server write policy!\n")
+                print_usage()
+                sys.exit(-1)
+            Server_Options['write_lock'] = opt_arg
+        elif opt == "--serve-queue":
+            try:
+                Server_Options['queue_size'] = int(opt_arg, 10)
+            except ValueError:
+                sys.stderr.write("Error: Invalid server queue size!\n")
+                sys.exit(-1)
+            if Server_Options['queue_size'] <= 0:
+                sys.stderr.write("Error: Invalid server queue size!\n")
+                sys.exit(-1)
+        elif opt == "--serve-slow":
+            if not opt_arg in ["drop", "lag"]:
+                sys.stderr.write("Error: Invalid server slow client policy!\n")
+                print_usage()
+                sys.exit(-1)
+            Server_Options['slow_client'] = opt_arg
 
         # Miscellaneous Options
+        elif opt == "--ping":
+            try:
+                ping_count = int(opt_arg, 10)
+            except ValueError:
+                sys.stderr.write("Error: Invalid ping count!\n")
+                sys.exit(-1)
+            if ping_count <= 0:
+                sys.stderr.write("Error: Invalid ping count!\n")
+                sys.exit(-1)
+        elif opt == "--capture":
+            Format_Options['capture_path'] = opt_arg
+        elif opt == "--histogram-dump":
+            Format_Options['histogram_dump'] = opt_arg
+        elif opt == "--scrollback":
+            try:
+                Format_Options['scrollback_size'] = int(opt_arg, 10)
+            except ValueError:
+                sys.stderr.write("Error: Invalid scrollback size!\n")
+                sys.exit(-1)
+            if Format_Options['scrollback_size'] < 0:
+                sys.stderr.write("Error: Invalid scrollback size!\n")
+                sys.exit(-1)
         elif opt in ("-h", "--help"):
             print_usage()
             sys.exit(0)
@@ -732,45 +2872,145 @@ def main():
             print_version()
             sys.exit(0)
 
+    # Timestamps are only supported in raw output mode
+    if Format_Options['timestamp'] != 'none' and Format_Options['output_mode'] != 'raw':
+        sys.stderr.write("Error: Timestamps are only supported in raw output mode!\n")
+        sys.exit(-1)
+
+    # Histogram dumps are only supported in histogram output mode
+    if Format_Options['histogram_dump'] is not None and Format_Options['output_mode'] != 'histogram':
+        sys.stderr.write("Error: Histogram dumps are only supported in histogram output mode!\n")
+        sys.exit(-1)
+
+    # Validate the line filter regular expressions
+    for pattern in (Format_Options['rx_include'], Format_Options['rx_exclude']):
+        if pattern is not None and not Format_Options['rx_filter_prefix']:
+            try:
+                filter_compile(pattern, False)
+            except re.error as err:
+                sys.stderr.write("Error: Invalid line filter \"%s\": %s\n" % (pattern, str(err)))
+                sys.exit(-1)
+
     # Make sure a serial port device is specified
     if len(args) < 1:
         print_usage()
         sys.exit(-1)
 
-    # Open the serial port with our options
+    # Connect to a server, or open the serial port with our options
     try:
-        serial_fd = serial_open(args[0], TTY_Options['baudrate'], TTY_Options['databits'], TTY_Options['stopbits'], TTY_Options['parity'], TTY_Options['flow_control'])
-    except Exception as err:
-        sys.stderr.write("Error opening serial port: %s\n" % str(err))
+        client_address = socket_address_parse(args[0])
+    except ValueError as err:
+        sys.stderr.write("Error: %s\n" % str(err))
         sys.exit(-1)
 
-    # Open stdin in raw mode
-    try:
-        stdin_fd = stdin_raw_open(Format_Options['echo'])
-    except Exception as err:
-        sys.stderr.write("Error opening stdin in raw mode: %s\n" % str(err))
-        sys.exit(-1)
+    if client_address is not None:
+        # Baudrate detection requires a serial port
+        if TTY_Options['baudrate'] == "auto":
+            sys.stderr.write("Error: Baudrate detection is not supported for server addresses!\n")
+            sys.exit(-1)
+
+        try:
+            serial_fd = socket_open(args[0])
+        except Exception as err:
+            sys.stderr.write("Error connecting to server: %s\n" % str(err))
+            sys.exit(-1)
+    else:
+        try:
+            serial_fd = serial_open(args[0], TTY_Options['baudrate'] if TTY_Options['baudrate'] != "auto" else 115200, TTY_Options['databits'], TTY_Options['stopbits'], TTY_Options['parity'], TTY_Options['flow_control'], TTY_Options['low_latency'])
+        except Exception as err:
+            sys.stderr.write("Error opening serial port: %s\n" % str(err))
+            sys.exit(-1)
+
+        # Detect the baudrate
+        if TTY_Options['baudrate'] == "auto":
+            sys.stderr.write("Detecting baudrate...\n")
+            try:
+                TTY_Options['baudrate'] = serial_detect_baudrate(serial_fd, sorted(Termios_Baudrates), Baudrate_Detect_Window)
+            except Exception as err:
+                sys.stderr.write("Error detecting baudrate: %s\n" % str(err))
+                sys.exit(-1)
+            sys.stderr.write("Detected baudrate: %d\n" % TTY_Options['baudrate'])
 
-    # Open stdout in raw mode
-    try:
-        stdout_fd = stdout_raw_open()
-    except Exception as err:
-        sys.stderr.write("Error opening stdout in raw mode: %s\n" % str(err))
-        sys.exit(-1)
+        # Set the serial driver low latency flag
+        if TTY_Options['low_latency']:
+            try:
+                serial_set_low_latency(serial_fd)
+            except Exception as err:
+                sys.stderr.write("Warning: %s\n" % str(err))
 
-    # Enter main read/write loop
-    try:
-        read_write_loop(serial_fd, stdin_fd, stdout_fd)
-    except Exception as err:
-        sys.stderr.write("Error: %s\n" % str(err))
-        raise
+    # Measure round-trip latency and quit
+    if ping_count is not None:
+        try:
+            rtts = sorted(ping_loop(serial_fd, ping_count))
+        except Exception as err:
+            sys.stderr.write("Error: %s\n" % str(err))
+            sys.exit(-1)
 
-    # Reset stdin to buffered mode
-    try:
-        stdin_reset()
-    except Exception as err:
-        sys.stderr.write("Error resetting stdin to buffered mode: %s\n" % str(err))
-        sys.exit(-1)
+        sys.stdout.write("%d probes, %d echoed, %.1f%% lost\n" % (ping_count, len(rtts), 100.0*(ping_count - len(rtts))/ping_count))
+        if len(rtts) > 0:
+            sys.stdout.write("rtt min/p50/p90/p99/max = %s ms\n" % "/".join("%.3f" % (x*1e3) for x in [rtts[0], percentile(rtts, 50), percentile(rtts, 90), percentile(rtts, 99), rtts[-1]]))
+
+        serial_close(serial_fd)
+        sys.exit(0 if len(rtts) == ping_count else 1)
+
+    # Open the capture file
+    capture_fd = None
+    if Format_Options['capture_path'] is not None:
+        try:
+            capture_fd = os.open(Format_Options['capture_path'], os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o644)
+        except OSError as err:
+            sys.stderr.write("Error opening capture file: %s\n" % str(err))
+            sys.exit(-1)
+
+    # Serve the serial port to clients
+    if Server_Options['address'] is not None:
+        try:
+            listen_sock = socket_listen(Server_Options['address'])
+        except Exception as err:
+            sys.stderr.write("Error opening server socket: %s\n" % str(err))
+            sys.exit(-1)
+
+        # Exit through the cleanup below when terminated
+        signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+
+        # Enter server loop until interrupted
+        try:
+            server_loop(serial_fd, listen_sock, capture_fd)
+        except KeyboardInterrupt:
+            pass
+        except Exception as err:
+            sys.stderr.write("Error: %s\n" % str(err))
+            raise
+        finally:
+            socket_close(listen_sock)
+    else:
+        # Open stdin in raw mode
+        try:
+            stdin_fd = stdin_raw_open(Format_Options['echo'])
+        except Exception as err:
+            sys.stderr.write("Error opening stdin in raw mode: %s\n" % str(err))
+            sys.exit(-1)
+
+        # Open stdout in raw mode
+        try:
+            stdout_fd = stdout_raw_open()
+        except Exception as err:
+            sys.stderr.write("Error opening stdout in raw mode: %s\n" % str(err))
+            sys.exit(-1)
+
+        # Enter main read/write loop
+        try:
+            read_write_loop(serial_fd, stdin_fd, stdout_fd, capture_fd)
+        except Exception as err:
+            sys.stderr.write("Error: %s\n" % str(err))
+            raise
+
+        # Reset stdin to buffered mode
+        try:
+            stdin_reset()
+        except Exception as err:
+            sys.stderr.write("Error resetting stdin to buffered mode: %s\n" % str(err))
+            sys.exit(-1)
 
     # Close the serial port
     try:
@@ -779,5 +3019,9 @@ def main():
         sys.stderr.write("Error closing serial port: %s\n" % str(err))
         sys.exit(-1)
 
+    # Close the capture file
+    if capture_fd is not None:
+        os.close(capture_fd)
+
 if __name__ == '__main__':
     main()
@@ -1,4 +1,10 @@
 import os
+import re
+import socket
+import tempfile
+import termios
+import threading
+import time
 import unittest
 import ssterm
 
@@ -46,6 +52,53 @@ class TestOutputProcessors(unittest.TestCase):
         self.assertEqual(f(b""), b"")
         self.assertEqual(f(b"r"), b"ar")
 
+    def test_processor_filter(self):
+        linesep = os.linesep.encode()
+        stats = {'filtered_bytes': 0, 'filtered_lines': 0}
+
+        f = ssterm.output_processor_filter(include=re.compile(b"^I"), exclude=re.compile(b"bar"), stats=stats)
+
+        self.assertEqual(f(b""), b"")
+        self.assertEqual(f(b"Ifoo" + linesep + b"Dfoo" + linesep), b"Ifoo" + linesep)
+        self.assertEqual(f(b"Ib"), b"")
+        self.assertEqual(f(b"ar" + linesep + b"Ibaz"), b"")
+        self.assertEqual(f(linesep), b"Ibaz" + linesep)
+        self.assertEqual(stats['filtered_lines'], 2)
+        self.assertEqual(stats['filtered_bytes'], 2*(4 + len(linesep)))
+
+        f = ssterm.output_processor_filter(include=(b"A", b"B"))
+
+        self.assertEqual(f(b"Afoo" + linesep + b"Cbar" + linesep + b"Bbaz" + linesep), b"Afoo" + linesep + b"Bbaz" + linesep)
+        self.assertEqual(f(b"C" * ssterm.Filter_Max_Line_Length), b"")
+        self.assertEqual(f(b"A" * ssterm.Filter_Max_Line_Length), b"A" * ssterm.Filter_Max_Line_Length)
+
+    def test_pipeline_flush(self):
+        linesep = os.linesep.encode()
+
+        pipeline = [ssterm.output_processor_newline(b"\r\n"), ssterm.output_processor_split(partial_lines=False)]
+
+        self.assertEqual(ssterm.pipeline_flush(pipeline), b"")
+        self.assertEqual(pipeline[0](b"AB\r"), b"AB")
+        self.assertEqual(pipeline[1](b"AB"), b"")
+        self.assertEqual(ssterm.pipeline_flush(pipeline), b"41 42 0d                                          |AB.             |" + linesep)
+        self.assertEqual(ssterm.pipeline_flush(pipeline), b"")
+
+        pipeline = [ssterm.output_processor_filter(include=(b"A",)), ssterm.output_processor_hexadecimal()]
+
+        self.assertEqual(pipeline[0](b"Bfoo" + linesep + b"Afoo"), b"")
+        self.assertEqual(ssterm.pipeline_flush(pipeline), b"41 66 6f 6f " + linesep)
+        self.assertEqual(ssterm.pipeline_flush(pipeline), b"")
+
+    def test_pipeline_timestamp_color(self):
+        linesep = os.linesep.encode()
+
+        # Timestamps precede color coded newlines
+        options = dict(ssterm.Format_Options, output_mode='raw', timestamp='delta', color_chars=linesep[-1:])
+        buf = b"a" + linesep + b"b"
+        for f in ssterm.output_pipeline_build(options):
+            buf = f(buf)
+        self.assertTrue(re.match(br"\[\+[0-9.]+\] a" + re.escape(linesep[:-1] + ssterm.Color_Codes[0] + linesep[-1:] + ssterm.Color_Code_Reset) + br"\[\+0\.000000\] b$", buf))
+
     def test_processor_raw(self):
         f = ssterm.output_processor_raw()
 
@@ -60,6 +113,27 @@ class TestOutputProcessors(unittest.TestCase):
         self.assertEqual(f(b"hello" + os.linesep.encode() + b"world"), b"hello" + os.linesep.encode() + b"world")
         self.assertEqual(f(b"helABlo"), b"hel" + ssterm.Color_Codes[0] + b"A" + ssterm.Color_Code_Reset + ssterm.Color_Codes[1] + b"B" + ssterm.Color_Code_Reset + b"lo")
 
+    def test_processor_timestamp(self):
+        linesep = os.linesep.encode()
+
+        f = ssterm.output_processor_timestamp('mono')
+
+        self.assertEqual(f(b""), b"")
+        self.assertTrue(re.match(br"^\[\d+\.\d{6}\] foo$", f(b"foo")))
+        self.assertEqual(f(b"bar" + linesep), b"bar" + linesep)
+        self.assertTrue(re.match(br"^\[\d+\.\d{6}\] a" + re.escape(linesep) + br"\[\d+\.\d{6}\] " + re.escape(linesep) + br"\[\d+\.\d{6}\] b$", f(b"a" + linesep + linesep + b"b")))
+        self.assertEqual(f(linesep), linesep)
+        self.assertTrue(re.match(br"^\[\d+\.\d{6}\] c$", f(b"c")))
+
+        f = ssterm.output_processor_timestamp('wall')
+
+        self.assertTrue(re.match(br"^\[\d\d:\d\d:\d\d\.\d{6}\] foo" + re.escape(linesep) + b"$", f(b"foo" + linesep)))
+
+        f = ssterm.output_processor_timestamp('delta')
+
+        self.assertTrue(re.match(br"^\[\+\d+\.\d{6}\] foo$", f(b"foo")))
+        self.assertTrue(re.match(re.escape(linesep) + br"\[\+\d+\.\d{6}\] a" + re.escape(linesep) + br"\[\+0\.000000\] b$", f(linesep + b"a" + linesep + b"b")))
+
     def test_processor_hexadecimal(self):
         f = ssterm.output_processor_hexadecimal()
 
@@ -108,6 +182,654 @@ class TestOutputProcessors(unittest.TestCase):
         self.assertEqual(f(b""), b"")
         self.assertEqual(f(b"0ABC"), b"\r30 " + ssterm.Color_Codes[0] + b"41" + ssterm.Color_Code_Reset + b" " + ssterm.Color_Codes[1] + b"42" + ssterm.Color_Code_Reset + b" 43                                       |0" + ssterm.Color_Codes[0] + b"A" + ssterm.Color_Code_Reset + ssterm.Color_Codes[1] + b"B" + ssterm.Color_Code_Reset + b"C" + b"            |")
 
+    def test_processor_histogram(self):
+        f = ssterm.output_processor_histogram()
+
+        self.assertEqual(f(b""), b"")
+        self.assertTrue(f(b"ab").startswith(b"\x1b[2J\x1b[HReceived 2 B in 1 chunks"))
+        self.assertEqual(f.refresh_time(), None)
+        # Refresh is rate limited, and deferred to the refresh time
+        self.assertEqual(f(b"c"), b"")
+        self.assertEqual(f.histogram.bytes, 3)
+        refresh_time = f.refresh_time()
+        self.assertTrue(refresh_time is not None)
+        self.assertTrue(f.refresh(refresh_time).startswith(b"\x1b[2J\x1b[HReceived 3 B in 2 chunks"))
+        self.assertEqual(f.refresh_time(), None)
+        self.assertTrue(f.flush().startswith(b"\x1b[2J\x1b[HReceived 3 B in 2 chunks"))
+
+class TestHistogram(unittest.TestCase):
+    def test_update(self):
+        h = ssterm.Histogram()
+
+        h.update(b"", 1.0)
+        self.assertEqual(h.chunks, 0)
+        h.update(b"a", 1.0)
+        h.update(b"ab" * 100, 1.0015)
+        h.update(b"\x00\xff\x00", 3.0)
+
+        self.assertEqual((h.bytes, h.chunks), (204, 3))
+        self.assertEqual((h.values[ord("a")], h.values[ord("b")], h.values[0], h.values[255]), (101, 100, 2, 1))
+        self.assertEqual(sum(h.values), 204)
+        # Chunk sizes of 1, 200, 3 bytes
+        self.assertEqual([k for k in range(ssterm.Histogram_Bins) if h.sizes[k]], [1, 2, 8])
+        # Gaps of 1500 us and 1998500 us
+        self.assertEqual([k for k in range(ssterm.Histogram_Bins) if h.gaps[k]], [11, 21])
+
+    def test_entropy(self):
+        h = ssterm.Histogram()
+        self.assertEqual(h.entropy(), 0.0)
+        h.update(b"aaaa", 0.0)
+        self.assertEqual(h.entropy(), 0.0)
+        h.update(b"bbbb", 1.0)
+        self.assertTrue(abs(h.entropy() - 1.0) < 1e-9)
+
+        h = ssterm.Histogram()
+        h.update(bytes(bytearray(range(256))), 0.0)
+        self.assertTrue(abs(h.entropy() - 8.0) < 1e-9)
+
+    def test_dump(self):
+        h = ssterm.Histogram()
+        h.update(b"aa", 0.0)
+        h.update(b"a", 0.25)
+
+        lines = h.dump().splitlines()
+        self.assertEqual(lines[:2], ["# bytes 3, chunks 2", "kind,start,end,count"])
+        self.assertIn("byte,97,98,3", lines)
+        self.assertIn("size_bytes,1,2,1", lines)
+        self.assertIn("size_bytes,2,4,1", lines)
+        self.assertIn("gap_us,131072,262144,1", lines)
+
+class TestScrollback(unittest.TestCase):
+    def test_append(self):
+        s = ssterm.Scrollback(16, max_lines=4)
+
+        self.assertEqual(s.contents(), (0, b""))
+        s.append(b"", 1.0)
+        self.assertEqual(s.contents(), (0, b""))
+        s.append(b"abc\nde", 1.0)
+        self.assertEqual(s.contents(), (0, b"abc\nde"))
+        s.append(b"f\nghijklmno\n", 2.0)
+        self.assertEqual(s.contents(), (2, b"c\ndef\nghijklmno\n"))
+        s.append(b"0123456789abcdefXYZ", 3.0)
+        self.assertEqual(s.contents(), (21, b"3456789abcdefXYZ"))
+
+    def test_line_lookup(self):
+        s = ssterm.Scrollback(64, max_lines=3)
+
+        self.assertEqual(s.line_lookup(0), None)
+        s.append(b"foo\nbar", 1.0)
+        self.assertEqual(s.line_lookup(2), (0, 1.0))
+        self.assertEqual(s.line_lookup(5), (4, 1.0))
+        s.append(b"\n", 2.0)
+        s.append(b"baz\nqux\n", 3.0)
+        self.assertEqual(s.line_lookup(1), None)
+        self.assertEqual(s.line_lookup(5), (4, 1.0))
+        self.assertEqual(s.line_lookup(9), (8, 3.0))
+        self.assertEqual(s.line_lookup(13), (12, 3.0))
+
+    def test_line_lookup_newline(self):
+        s = ssterm.Scrollback(64, max_lines=4, newline=b"\r")
+
+        s.append(b"foo\rbar\nbaz\r", 1.0)
+        s.append(b"qux", 2.0)
+        self.assertEqual(s.line_lookup(6), (4, 1.0))
+        self.assertEqual(s.line_lookup(13), (12, 2.0))
+
+        s = ssterm.Scrollback(64, max_lines=4, newline=b"\r\n")
+        s.append(b"foo\rbar\nbaz", 1.0)
+        self.assertEqual(s.line_lookup(5), (4, 1.0))
+        self.assertEqual(s.line_lookup(9), (8, 1.0))
+
+    def test_region(self):
+        s = ssterm.Scrollback(4096)
+
+        s.append(b"foo\nbar baz\nqux", 1.0)
+        offset, data = s.contents()
+        self.assertEqual(s.region(offset, data, 8, 11), (4, 12, 1.0))
+        self.assertEqual(s.region(offset, data, 12, 15), (12, 15, 1.0))
+
+        # Regions are bounded without newlines
+        s.append(b"x" * 2048 + b"error" + b"y" * 1024, 2.0)
+        offset, data = s.contents()
+        self.assertEqual(s.region(offset, data, 2063, 2068), (2063 - ssterm.Scrollback_Render_Context, 2068 + ssterm.Scrollback_Render_Context, 1.0))
+        self.assertEqual(s.region(offset, data, 100, 3000), (100 - ssterm.Scrollback_Render_Context, 100 - ssterm.Scrollback_Render_Context + ssterm.Scrollback_Render_Max, 1.0))
+
+class TestOutputQueue(unittest.TestCase):
+    def test_skip_resume(self):
+        linesep = os.linesep.encode()
+        q = ssterm.OutputQueue(max_latency=0.5)
+
+        q.append(b"message", 0.0)
+        q.append(b"data1", 0.0, 5)
+        q.append(b"data2", 0.25, 5)
+        self.assertEqual(q.pending, 17)
+        self.assertEqual(q.latency(0.25), 0.25)
+        self.assertFalse(q.overloaded(0.25))
+        self.assertTrue(q.overloaded(0.75))
+
+        # Received data is skipped, messages are kept
+        q.overload(0.75)
+        self.assertEqual([entry[2] for entry in q.queue], [b"message"])
+        self.assertEqual(q.pending, 7)
+        q.skip(1000000)
+        self.assertFalse(q.overloaded(10.0))
+        self.assertEqual(q.resume_time(), 1.25)
+
+        # Skipped data is summarized in its place
+        self.assertEqual(q.resume(3725.0), 1000010)
+        self.assertEqual(q.skipping, None)
+        self.assertEqual(q.queue[-1][2], linesep + b"[skipped 1.0 MB, 01:02:05]" + linesep)
+
+    def test_behind(self):
+        q = ssterm.OutputQueue(max_latency=0.5)
+
+        q.read_update(True, 1.0)
+        q.read_update(True, 1.25)
+        self.assertEqual(q.latency(1.5), 0.5)
+        self.assertTrue(q.overloaded(1.75))
+        q.read_update(False, 1.75)
+        self.assertFalse(q.overloaded(1.75))
+
+    def test_hold(self):
+        q = ssterm.OutputQueue(max_latency=0.5, max_held=8)
+
+        q.hold(b"abcd", 0.0)
+        q.hold(b"efgh", 0.25)
+        self.assertFalse(q.overloaded(0.25))
+        self.assertEqual(q.release(), [0.0, b"abcd"])
+        self.assertEqual(q.held_bytes, 4)
+
+        # Held data counts towards the latency budget
+        self.assertTrue(q.overloaded(1.0))
+
+        # Held data exceeding the limit is skipped
+        q = ssterm.OutputQueue(max_held=8)
+        q.hold(b"abcd", 0.0)
+        q.hold(b"efgh", 0.0)
+        self.assertFalse(q.overloaded(100.0))
+        q.hold(b"i", 0.0)
+        self.assertTrue(q.overloaded(0.0))
+        q.overload(0.0)
+        self.assertEqual((len(q.held), q.held_bytes, q.skipping['bytes']), (0, 0, 9))
+
+    def test_write(self):
+        q = ssterm.OutputQueue()
+        self.assertTrue(q.readable())
+        q.append(b"x" * ssterm.Output_Queue_Max, 0.0, 1)
+        self.assertFalse(q.readable())
+
+        r, w = os.pipe()
+        try:
+            q = ssterm.OutputQueue()
+            q.append(b"a" * (ssterm.WRITE_BUF_SIZE + 1), 0.0, 1)
+            q.append(b"b", 0.0)
+            q.write(w)
+            self.assertEqual(q.pending, 2)
+            q.flush(w)
+            self.assertEqual((len(q.queue), q.pending), (0, 0))
+            self.assertEqual(os.read(r, 2*ssterm.WRITE_BUF_SIZE), b"a" * (ssterm.WRITE_BUF_SIZE + 1) + b"b")
+        finally:
+            os.close(r)
+            os.close(w)
+
+class TestReadWriteLoop(unittest.TestCase):
+    def setUp(self):
+        self.format_options = dict(ssterm.Format_Options)
+        self.master, slave = os.openpty()
+        self.serial_fd = ssterm.serial_open(os.ttyname(slave), 115200, 8, 1, "none", "none")
+        os.close(slave)
+        self.stdin_r, self.stdin_w = os.pipe()
+        self.stdout_r, self.stdout_w = os.pipe()
+        self.output = b""
+
+    def tearDown(self):
+        for fd in (self.master, self.serial_fd, self.stdin_r, self.stdin_w, self.stdout_r, self.stdout_w):
+            os.close(fd)
+        ssterm.Format_Options.clear()
+        ssterm.Format_Options.update(self.format_options)
+
+    def start(self, **format_options):
+        ssterm.Format_Options.update(format_options)
+
+        self.loop = threading.Thread(target=ssterm.read_write_loop, args=(self.serial_fd, self.stdin_r, self.stdout_w))
+        self.loop.daemon = True
+        self.loop.start()
+
+        def drain():
+            while self.loop.is_alive() or ssterm.select.select([self.stdout_r], [], [], 0)[0]:
+                if ssterm.select.select([self.stdout_r], [], [], 0.05)[0]:
+                    self.output += os.read(self.stdout_r, 65536)
+        self.drain = threading.Thread(target=drain)
+        self.drain.daemon = True
+        self.drain.start()
+
+    def stop(self):
+        os.write(self.stdin_w, b"\x1d")
+        self.loop.join(5)
+        self.assertFalse(self.loop.is_alive())
+        self.drain.join(5)
+
+    def flood(self, duration):
+        deadline = time.time() + duration
+        while time.time() < deadline:
+            os.write(self.master, b"0123456789abcdef" * 256)
+
+    def test_echo(self):
+        self.start(output_mode='raw')
+        os.write(self.master, b"hello")
+        os.write(self.stdin_w, b"world")
+        self.assertEqual(os.read(self.master, 5), b"world")
+        time.sleep(0.1)
+        self.stop()
+        self.assertEqual(self.output, b"hello")
+
+    def test_scrollback_search(self):
+        linesep = os.linesep.encode()
+        self.start(output_mode='splitfull')
+
+        os.write(self.master, b"error: 123456789012345678\n")
+        time.sleep(0.1)
+        os.write(self.stdin_w, b"\x14/error\r\r")
+        time.sleep(0.2)
+        self.stop()
+
+        # The whole line is rendered, including its partial last row
+        self.assertIn(b"Match 1/1 at offset 0", self.output)
+        self.assertIn(b"|012345678.      |" + linesep, self.output[self.output.index(b"Match 1/1"):])
+
+    def test_histogram_refresh(self):
+        self.start(output_mode='histogram')
+
+        for _ in range(5):
+            os.write(self.master, b"x" * 100)
+            time.sleep(0.02)
+
+        # The view is refreshed after the burst without further data
+        time.sleep(ssterm.Histogram_Refresh_Interval + 0.5)
+        self.assertIn(b"Received 500 B in 5 chunks", self.output[self.output.rindex(b"\x1b[H"):])
+
+        # The final view is drawn on exit
+        views = self.output.count(b"\x1b[H")
+        self.stop()
+        self.assertEqual(self.output.count(b"\x1b[H"), views + 1)
+
+    def test_histogram_all_bytes(self):
+        path = os.path.join(tempfile.mkdtemp(), "histogram.csv")
+        self.start(output_mode='histogram', max_latency=1, histogram_dump=path)
+
+        # Data received while a prompt is open, and over the latency budget,
+        # is counted
+        os.write(self.stdin_w, b"\x14/")
+        time.sleep(0.1)
+        for _ in range(5):
+            os.write(self.master, b"x" * 100)
+            time.sleep(0.02)
+        os.write(self.stdin_w, b"\x1b")
+        time.sleep(0.1)
+        self.stop()
+
+        self.assertIn(b"Received 500 B in 5 chunks", self.output[self.output.rindex(b"\x1b[H"):])
+        self.assertNotIn(b"[skipped", self.output)
+        with open(path) as dump_file:
+            self.assertIn("byte,120,121,500", dump_file.read().splitlines())
+        os.unlink(path)
+        os.rmdir(os.path.dirname(path))
+
+    def test_prompt_flood(self):
+        self.start(output_mode='split', max_latency=200)
+
+        # Flood while a prompt is open
+        os.write(self.stdin_w, b"\x14/")
+        self.flood(1.0)
+        os.write(self.stdin_w, b"\x1b")
+        self.flood(0.5)
+
+        # Quit stays responsive, and the flood is summarized
+        start = time.time()
+        self.stop()
+        self.assertTrue(time.time() - start < 2.0)
+        self.assertTrue(re.search(br"\[skipped [0-9.]+ [KM]?B, 00:00:0[0-9]\]", self.output))
+
+class TestSerialHelpers(unittest.TestCase):
+    def test_baudrate_score(self):
+        self.assertEqual(ssterm.baudrate_score(b""), 0)
+        self.assertAlmostEqual(ssterm.baudrate_score(b"\xff\x00\x00"), -2.0)
+        self.assertAlmostEqual(ssterm.baudrate_score(b"hello world"), 1.0)
+        self.assertAlmostEqual(ssterm.baudrate_score(b"hello\r\nworld\r\n"), 1.1)
+        self.assertAlmostEqual(ssterm.baudrate_score(b"he\x80\x81"), 0.5)
+        self.assertAlmostEqual(ssterm.baudrate_score(b"\xff\xffabc"), 0.75)
+        self.assertAlmostEqual(ssterm.baudrate_score(b"\xff\x00aaaa"), 0.5)
+        self.assertTrue(ssterm.baudrate_score(b"GPS,1,2,3\r\n" * 4) > ssterm.baudrate_score(b"\xff\x00\x12\xe0\x80\xff\x00\x7f\x80\x00"))
+
+    def test_modem_lines_format(self):
+        t = time.mktime((2016, 10, 2, 12, 34, 56, 0, 0, -1)) + 0.25
+        cts, dsr, dtr = termios.TIOCM_CTS, termios.TIOCM_DSR, termios.TIOCM_DTR
+
+        self.assertEqual(ssterm.modem_lines_format(t, None, cts | dtr), "[modem 12:34:56.250000 CTS=1 DSR=0 DCD=0 RI=0 DTR=1 RTS=0]")
+        self.assertEqual(ssterm.modem_lines_format(t, cts | dtr, dsr | dtr), "[modem 12:34:56.250000 -CTS +DSR DCD=0 RI=0 DTR=1 RTS=0]")
+        self.assertEqual(ssterm.modem_lines_format(t, cts, cts, ["DCD", "RI"]), "[modem 12:34:56.250000 CTS=1 DSR=0 DCD=0 RI=0 DTR=0 RTS=0 DCD pulse RI pulse]")
+        self.assertEqual(ssterm.modem_lines_format(t, cts, cts), "[modem 12:34:56.250000 CTS=1 DSR=0 DCD=0 RI=0 DTR=0 RTS=0 transient change]")
+
+    def test_modem_lines_pulses(self):
+        cts, dsr = termios.TIOCM_CTS, termios.TIOCM_DSR
+
+        self.assertEqual(ssterm.serial_modem_lines_pulses(cts, dsr, None, (0, 0, 0, 0)), None)
+        # Net changes of CTS and DSR are not pulses
+        self.assertEqual(ssterm.serial_modem_lines_pulses(cts, dsr, (0, 0, 0, 0), (1, 1, 0, 0)), [])
+        # CTS toggled twice, DSR three times, RI once with no net change
+        self.assertEqual(ssterm.serial_modem_lines_pulses(cts, cts | dsr, (0, 0, 0, 0), (2, 3, 1, 0)), ["CTS", "DSR", "RI"])
+
+    def test_reconfigure_parse(self):
+        tty_options = dict(ssterm.TTY_Options)
+        format_options = dict(ssterm.Format_Options)
+
+        self.assertEqual(ssterm.reconfigure_parse("", tty_options, format_options), (tty_options, format_options))
+
+        new_tty_options, new_format_options = ssterm.reconfigure_parse("baudrate=9600 stopbits=2 output=split rx-nl=crlf", tty_options, format_options)
+        self.assertEqual(new_tty_options, dict(tty_options, baudrate=9600, stopbits=2))
+        self.assertEqual(new_format_options, dict(format_options, output_mode='split', receive_newline='crlf'))
+        self.assertEqual(tty_options, ssterm.TTY_Options)
+
+        self.assertRaises(ValueError, ssterm.reconfigure_parse, "foo=bar", tty_options, format_options)
+        self.assertRaises(ValueError, ssterm.reconfigure_parse, "baudrate=fast", tty_options, format_options)
+        self.assertRaises(ValueError, ssterm.reconfigure_parse, "databits=9", tty_options, format_options)
+        self.assertRaises(ValueError, ssterm.reconfigure_parse, "output=bar", tty_options, format_options)
+        self.assertRaises(ValueError, ssterm.reconfigure_parse, "output=hex timestamp=wall", tty_options, format_options)
+
+class TestPing(unittest.TestCase):
+    def test_percentile(self):
+        self.assertEqual(ssterm.percentile([], 50), None)
+        self.assertEqual(ssterm.percentile([1], 99), 1)
+        self.assertEqual(ssterm.percentile([1, 2, 3, 4], 50), 2)
+        self.assertEqual(ssterm.percentile(list(range(1, 101)), 90), 90)
+        self.assertEqual(ssterm.percentile(list(range(1, 101)), 99), 99)
+        self.assertEqual(ssterm.percentile(list(range(1, 101)), 100), 100)
+        self.assertEqual(ssterm.percentile(list(range(1, 101)), 0), 1)
+
+class TestTransmitScheduler(unittest.TestCase):
+    def test_char_line_delay(self):
+        s = ssterm.TransmitScheduler(char_delay=0.25, line_delay=1.0)
+        self.assertEqual(s.poll(0.0), (b"", None))
+        s.push(b"ab\nc")
+        self.assertEqual(s.poll(0.0), (b"a", 0.25))
+        self.assertEqual(s.poll(0.125), (b"", 0.25))
+        self.assertEqual(s.poll(0.25), (b"b", 0.5))
+        self.assertEqual(s.poll(0.5), (b"\n", 1.5))
+        self.assertEqual(s.pending(), 1)
+        self.assertEqual(s.poll(1.0), (b"", 1.5))
+        self.assertEqual(s.poll(1.5), (b"c", None))
+
+        s = ssterm.TransmitScheduler(line_delay=1.0)
+        s.push(b"ab\ncd\ne")
+        self.assertEqual(s.poll(0.0), (b"ab\n", 1.0))
+        self.assertEqual(s.poll(1.0), (b"cd\n", 2.0))
+        self.assertEqual(s.poll(2.0), (b"e", None))
+
+        s.push(b"abc")
+        self.assertEqual(s.cancel(), 3)
+        self.assertEqual(s.poll(3.0), (b"", None))
+
+    def test_echo_wait(self):
+        s = ssterm.TransmitScheduler(echo_wait=True, newline=b"\r")
+        s.push(b"ab\rcd\r")
+        self.assertEqual(s.poll(0.0), (b"ab\r", ssterm.TX_Echo_Timeout))
+        self.assertEqual(s.poll(0.1), (b"", ssterm.TX_Echo_Timeout))
+        s.receive(b"ab", 0.0)
+        self.assertEqual(s.poll(0.2), (b"", ssterm.TX_Echo_Timeout))
+        s.receive(b"\r\n> ", 0.0)
+        self.assertEqual(s.poll(0.3), (b"cd\r", 0.3 + ssterm.TX_Echo_Timeout))
+        # Echo timeout
+        self.assertEqual(s.poll(0.3 + ssterm.TX_Echo_Timeout), (b"", None))
+
+    def test_adaptive(self):
+        s = ssterm.TransmitScheduler(adaptive=True)
+        s.push(b"abcdefgh")
+        # Window grows on matched echoes
+        self.assertEqual(s.poll(0.0)[0], b"a")
+        s.receive(b"a", 0.0)
+        self.assertEqual(s.poll(0.0)[0], b"bc")
+        s.receive(b"b\r\nc", 0.0)
+        self.assertEqual(s.window, 3)
+        self.assertEqual(s.poll(0.0)[0], b"def")
+        # Window shrinks, then delay grows on lost echoes
+        s.receive(b"df", 0.0)
+        self.assertEqual(s.poll(ssterm.TX_Echo_Timeout)[0], b"g")
+        self.assertEqual((s.window, s.delay, s.losses), (1, 0.0, 1))
+        s.receive(b"x" * (2 + ssterm.TX_Echo_Slack), 0.0)
+        self.assertEqual((s.window, s.delay, s.losses), (1, ssterm.TX_Adaptive_Min_Delay, 2))
+        # Delay applies to the next character
+        self.assertEqual(s.poll(ssterm.TX_Echo_Timeout)[0], b"h")
+        s.receive(b"h", 0.0)
+        self.assertEqual((s.window, s.delay, s.pending()), (1, 0.0, 0))
+        s.push(b"i")
+        self.assertEqual(s.poll(ssterm.TX_Echo_Timeout), (b"", ssterm.TX_Echo_Timeout + ssterm.TX_Adaptive_Min_Delay))
+
+class TestSocketHelpers(unittest.TestCase):
+    def test_address_parse(self):
+        self.assertEqual(ssterm.socket_address_parse("/dev/ttyUSB0"), None)
+        self.assertEqual(ssterm.socket_address_parse("unix:/tmp/foo.sock"), (socket.AF_UNIX, "/tmp/foo.sock"))
+        self.assertEqual(ssterm.socket_address_parse("tcp::5000"), (socket.AF_INET, ("", 5000)))
+        self.assertEqual(ssterm.socket_address_parse("tcp::5000", "localhost"), (socket.AF_INET, ("localhost", 5000)))
+        self.assertEqual(ssterm.socket_address_parse("tcp:10.0.0.1:5000"), (socket.AF_INET, ("10.0.0.1", 5000)))
+        self.assertEqual(ssterm.socket_address_parse("tcp:[::1]:5000"), (socket.AF_INET6, ("::1", 5000)))
+        self.assertRaises(ValueError, ssterm.socket_address_parse, "tcp:5000")
+        self.assertRaises(ValueError, ssterm.socket_address_parse, "tcp:host:foo")
+
+    def test_listen_stale(self):
+        path = os.path.join(tempfile.mkdtemp(), "ssterm.sock")
+        try:
+            # A socket left behind is replaced
+            stale = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            stale.bind(path)
+            stale.close()
+            ssterm.socket_close(ssterm.socket_listen("unix:" + path))
+            self.assertFalse(os.path.exists(path))
+
+            # Other files are not
+            open(path, "w").close()
+            self.assertRaises(Exception, ssterm.socket_listen, "unix:" + path)
+            self.assertTrue(os.path.exists(path))
+            os.unlink(path)
+        finally:
+            os.rmdir(os.path.dirname(path))
+
+class TestServerLoop(unittest.TestCase):
+    def setUp(self):
+        self.server_options = dict(ssterm.Server_Options)
+        self.master, slave = os.openpty()
+        self.serial_fd = ssterm.serial_open(os.ttyname(slave), 115200, 8, 1, "none", "none")
+        os.close(slave)
+
+        self.path = os.path.join(tempfile.mkdtemp(), "ssterm.sock")
+        self.listen_sock = ssterm.socket_listen("unix:" + self.path)
+        self.clients = []
+        self.log = []
+
+    def tearDown(self):
+        # Hanging up the serial port ends the server loop
+        os.close(self.master)
+        if hasattr(self, 'thread'):
+            self.thread.join(5)
+        for sock in self.clients:
+            sock.close()
+        ssterm.socket_close(self.listen_sock)
+        os.rmdir(os.path.dirname(self.path))
+        os.close(self.serial_fd)
+        ssterm.Server_Options.update(self.server_options)
+
+    def start(self, **server_options):
+        ssterm.Server_Options.update(server_options)
+
+        def run():
+            try:
+                ssterm.server_loop(self.serial_fd, self.listen_sock, log=self.log.append)
+            except Exception:
+                pass
+
+        self.thread = threading.Thread(target=run)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def connect(self):
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.settimeout(5)
+        sock.connect(self.path)
+        self.clients.append(sock)
+
+        # Wait for the server to accept the client
+        os.write(self.master, b"!")
+        self.assertEqual(sock.recv(1), b"!")
+        for other in self.clients[:-1]:
+            self.assertEqual(other.recv(1), b"!")
+
+        return sock
+
+    def recv(self, sock, n):
+        buf = b""
+        while len(buf) < n:
+            data = sock.recv(n - len(buf))
+            if len(data) == 0:
+                break
+            buf += data
+        return buf
+
+    def serial_read(self, n, timeout=5):
+        buf = b""
+        deadline = time.time() + timeout
+        while len(buf) < n and time.time() < deadline:
+            if ssterm.select.select([self.master], [], [], 0.1)[0]:
+                buf += os.read(self.master, n - len(buf))
+        return buf
+
+    def flood(self, size):
+        # Write at a rate a reading client keeps up with
+        def write():
+            for _ in range(size // 4096):
+                os.write(self.master, b"x" * 4096)
+                time.sleep(0.001)
+        thread = threading.Thread(target=write)
+        thread.start()
+        return thread
+
+    def test_fan_out_write_lock(self):
+        self.start(write_lock='first')
+        a = self.connect()
+        b = self.connect()
+
+        # Received data is sent to all clients
+        os.write(self.master, b"hello")
+        self.assertEqual(self.recv(a, 5), b"hello")
+        self.assertEqual(self.recv(b, 5), b"hello")
+
+        # Only data from the first client is written to the serial port
+        b.sendall(b"from b")
+        a.sendall(b"from a")
+        self.assertEqual(self.serial_read(6), b"from a")
+        self.assertEqual(self.serial_read(1, timeout=0.2), b"")
+
+    def test_write_blocked(self):
+        self.start(write_lock='first', queue_size=4096)
+        a = self.connect()
+
+        # Fill the serial port transmit buffer and queue, which the device
+        # doesn't read
+        data = b"".join(("%07d\n" % i).encode() for i in range(32768))
+        sender = threading.Thread(target=a.sendall, args=(data,))
+        sender.daemon = True
+        sender.start()
+        time.sleep(0.2)
+
+        # Received data is still sent to clients
+        os.write(self.master, b"rx")
+        self.assertEqual(self.recv(a, 2), b"rx")
+
+        # Transmit data is written in order once the device reads
+        self.assertEqual(self.serial_read(len(data)), data)
+        sender.join(5)
+
+    def test_slow_client_drop(self):
+        self.start(queue_size=16384, slow_client='drop')
+        fast = self.connect()
+        slow = self.connect()
+
+        flood = self.flood(1048576)
+        self.assertEqual(len(self.recv(fast, 1048576)), 1048576)
+        flood.join()
+
+        # The slow client is disconnected after its queue overflows
+        self.assertTrue(len(self.recv(slow, 1048576)) < 1048576)
+        self.assertIn("unix client 2 disconnected: send queue overflow", self.log)
+
+    def test_slow_client_lag(self):
+        self.start(queue_size=16384, slow_client='lag')
+        fast = self.connect()
+        slow = self.connect()
+
+        flood = self.flood(1048576)
+        self.assertEqual(len(self.recv(fast, 1048576)), 1048576)
+        flood.join()
+
+        # The slow client stays connected, with its oldest data discarded
+        os.write(self.master, b"end")
+        self.assertEqual(self.recv(fast, 3), b"end")
+        buf = b""
+        while not buf.endswith(b"end"):
+            data = slow.recv(65536)
+            self.assertTrue(len(data) > 0)
+            buf += data
+        self.assertTrue(len(buf) < 1048576)
+
+@unittest.skipIf(ssterm.asyncio is None, "asyncio not available")
+class TestSerialTerminal(unittest.TestCase):
+    def test_read_write(self):
+        linesep = os.linesep.encode()
+        master, slave = os.openpty()
+        loop = ssterm.asyncio.new_event_loop()
+
+        try:
+            term = ssterm.SerialTerminal(os.ttyname(slave), format_options={'receive_newline': 'crlf', 'transmit_newline': 'crlf'}, loop=loop).open()
+
+            os.write(master, b"foo\r\nbar\r")
+            self.assertEqual(loop.run_until_complete(term.reader.readline()), b"foo" + linesep)
+            os.write(master, b"\n")
+            self.assertEqual(loop.run_until_complete(term.reader.readline()), b"bar" + linesep)
+
+            term.write(b"abc" + linesep)
+            loop.run_until_complete(term.drain())
+            self.assertEqual(os.read(master, 5), b"abc\r\n")
+            self.assertEqual(term.stats['tx_bytes'], 5)
+
+            term.close()
+            self.assertTrue(term.reader.at_eof())
+        finally:
+            loop.close()
+            os.close(master)
+            os.close(slave)
+
+    def test_read_backpressure(self):
+        master, slave = os.openpty()
+        loop = ssterm.asyncio.new_event_loop()
+
+        try:
+            term = ssterm.SerialTerminal(os.ttyname(slave), loop=loop, limit=64).open()
+
+            # Reading pauses while unconsumed data exceeds the limit
+            data = bytes(bytearray(range(256))) * 16
+            os.write(master, data)
+            loop.run_until_complete(ssterm.asyncio.sleep(0.1))
+            self.assertFalse(term.reading)
+            self.assertTrue(term.stats['rx_bytes'] < len(data))
+
+            # Reading resumes as data is consumed
+            self.assertEqual(loop.run_until_complete(term.reader.readexactly(len(data))), data)
+            self.assertTrue(term.reading)
+
+            term.close()
+            self.assertFalse(term.reading)
+        finally:
+            loop.close()
+            os.close(master)
+            os.close(slave)
 
 if __name__ == '__main__':
     unittest.main()